@@ -1,14 +1,55 @@
 from datetime import datetime
-from typing import Dict, Any, List, Tuple
-from collections import defaultdict
+from typing import Dict, Any, List, Tuple, Optional
 
-def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str) -> Dict:
+def parse_iso_datetime(date_str: str) -> datetime:
+    """
+    Parse an ISO-8601 date/timestamp, accepting a trailing 'Z' for UTC.
+    Raises ValueError on malformed input.
+    """
+    if date_str.endswith("Z"):
+        return datetime.fromisoformat(date_str[:-1] + "+00:00")
+    return datetime.fromisoformat(date_str)
+
+def parse_transaction_dates(transactions: List[Dict]) -> Dict[str, datetime]:
+    """
+    Parse every transaction date once, keyed by txn_id.
+    Transactions with a missing or malformed date are left out.
+    Each distinct date string is only parsed once, since many transactions share a day.
+    """
+    txn_dates = {}
+    parsed = {}
+    for t in transactions:
+        try:
+            date_str = t["date"]
+            t_date = parsed.get(date_str)
+            if t_date is None:
+                t_date = parsed[date_str] = parse_iso_datetime(date_str)
+            txn_dates[t["txn_id"]] = t_date
+        except (ValueError, KeyError):
+            continue
+    return txn_dates
+
+BaselineSets = Tuple[frozenset, frozenset, frozenset]
+
+def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str, txn_dates: Optional[Dict[str, datetime]] = None) -> Dict:
     """
     Compute baseline metrics from transactions BEFORE the alert month.
     """
+    baseline, _ = compute_behavioral_baseline_with_sets(transactions, alert_date_str, txn_dates)
+    return baseline
+
+def compute_behavioral_baseline_with_sets(transactions: List[Dict], alert_date_str: str, txn_dates: Optional[Dict[str, datetime]] = None) -> Tuple[Dict, BaselineSets]:
+    """
+    Same as compute_behavioral_baseline, but also returns the usual
+    (counterparties, geographies, channels) as frozensets for membership checks.
+    The baseline dict keeps its JSON-friendly lists.
+    """
+    if txn_dates is None:
+        txn_dates = parse_transaction_dates(transactions)
+
     try:
         # Handle ISO format with Z
-        alert_date = datetime.fromisoformat(alert_date_str.replace("Z", "+00:00"))
+        alert_date = parse_iso_datetime(alert_date_str)
     except ValueError:
         # Fallback if parsing fails, though ISO is expected
         alert_date = datetime.now()
@@ -16,15 +57,15 @@ def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str) -
     alert_year = alert_date.year
     alert_month = alert_date.month
 
+    # (txn, parsed date) pairs so each date is only parsed once
     baseline_txns = []
     for t in transactions:
-        try:
-            t_date = datetime.fromisoformat(t["date"].replace("Z", "+00:00"))
-            # Filter for BEFORE alert month
-            if t_date.year < alert_year or (t_date.year == alert_year and t_date.month < alert_month):
-                baseline_txns.append(t)
-        except (ValueError, KeyError):
+        t_date = txn_dates.get(t.get("txn_id"))
+        if t_date is None:
             continue
+        # Filter for BEFORE alert month
+        if t_date.year < alert_year or (t_date.year == alert_year and t_date.month < alert_month):
+            baseline_txns.append((t, t_date))
 
     if not baseline_txns:
         return {
@@ -36,38 +77,37 @@ def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str) -
             "usual_channels": [],
             "baseline_period": "No baseline data",
             "max_single_txn": 0.0
-        }
+        }, (frozenset(), frozenset(), frozenset())
 
-    # Group by month string "YYYY-MM"
-    monthly_stats = defaultdict(lambda: {"inflow": 0.0, "outflow": 0.0, "count": 0})
+    # Distinct months, keyed by integer year*12 + month
+    months_seen = set()
     
     usual_counterparties = set()
     usual_geographies = set()
     usual_channels = set()
     max_txn = 0.0
+    total_inflow = 0.0
+    total_outflow = 0.0
     
     start_date = None
     end_date = None
 
-    for t in baseline_txns:
-        t_date = datetime.fromisoformat(t["date"].replace("Z", "+00:00"))
+    for t, t_date in baseline_txns:
         if start_date is None or t_date < start_date:
             start_date = t_date
         if end_date is None or t_date > end_date:
             end_date = t_date
 
-        month_key = f"{t_date.year}-{t_date.month:02d}"
+        months_seen.add(t_date.year * 12 + t_date.month)
         amount = float(t.get("amount", 0.0))
         
         if amount > max_txn:
             max_txn = amount
 
         if t.get("direction") == "inbound":
-            monthly_stats[month_key]["inflow"] += amount
+            total_inflow += amount
         else:
-            monthly_stats[month_key]["outflow"] += amount
-            
-        monthly_stats[month_key]["count"] += 1
+            total_outflow += amount
         
         if t.get("counterparty_name"):
             usual_counterparties.add(t["counterparty_name"])
@@ -76,11 +116,8 @@ def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str) -
         if t.get("channel"):
             usual_channels.add(t["channel"])
 
-    num_months = len(monthly_stats) if monthly_stats else 1
-    
-    total_inflow = sum(m["inflow"] for m in monthly_stats.values())
-    total_outflow = sum(m["outflow"] for m in monthly_stats.values())
-    total_count = sum(m["count"] for m in monthly_stats.values())
+    num_months = len(months_seen) if months_seen else 1
+    total_count = len(baseline_txns)
 
     period_str = ""
     if start_date and end_date:
@@ -95,30 +132,40 @@ def compute_behavioral_baseline(transactions: List[Dict], alert_date_str: str) -
         "usual_channels": list(usual_channels),
         "baseline_period": period_str,
         "max_single_txn": max_txn
-    }
+    }, (frozenset(usual_counterparties), frozenset(usual_geographies), frozenset(usual_channels))
 
-def compute_deviation_analysis(transactions: List[Dict], baseline: Dict, flagged_ids: List[str]) -> Dict:
+def compute_deviation_analysis(transactions: List[Dict], baseline: Dict, flagged_ids: List[str], txn_dates: Optional[Dict[str, datetime]] = None, baseline_sets: Optional[BaselineSets] = None) -> Dict:
     """
     Compare flagged transactions against baseline metrics.
     """
-    flagged_txns = [t for t in transactions if t["txn_id"] in flagged_ids]
+    flagged_set = frozenset(flagged_ids)
+    flagged_txns = [t for t in transactions if t["txn_id"] in flagged_set] if flagged_set else []
     
-    flagged_inflow = sum(float(t["amount"]) for t in flagged_txns if t.get("direction") == "inbound")
-    flagged_outflow = sum(float(t["amount"]) for t in flagged_txns if t.get("direction") != "inbound")
-    flagged_total_vol = flagged_inflow + flagged_outflow
+    # Nothing flagged: no deviation to measure
+    if not flagged_txns:
+        return {
+            "volume_deviation_factor": 0.0,
+            "velocity_spike": False,
+            "new_counterparties_count": 0,
+            "new_geographies": [],
+            "new_channels": [],
+            "deviation_summary": "No significant deviation",
+            "flagged_txn_count": 0,
+            "flagged_volume": 0.0
+        }
     
-    baseline_inflow = baseline.get("avg_monthly_inflow", 0.0)
-    baseline_outflow = baseline.get("avg_monthly_outflow", 0.0)
-    baseline_total_vol = baseline_inflow + baseline_outflow
+    if txn_dates is None:
+        txn_dates = parse_transaction_dates(flagged_txns)
     
-    if baseline_total_vol > 0:
-        volume_deviation_factor = round(flagged_total_vol / baseline_total_vol, 1)
+    if baseline_sets is not None:
+        usual_cps, usual_geos, usual_chans = baseline_sets
     else:
-        volume_deviation_factor = 999.0 if flagged_total_vol > 0 else 0.0
-
-    usual_cps = set(baseline.get("usual_counterparties", []))
-    usual_geos = set(baseline.get("usual_geographies", []))
-    usual_chans = set(baseline.get("usual_channels", []))
+        usual_cps = frozenset(baseline.get("usual_counterparties", []))
+        usual_geos = frozenset(baseline.get("usual_geographies", []))
+        usual_chans = frozenset(baseline.get("usual_channels", []))
+    
+    flagged_inflow = 0.0
+    flagged_outflow = 0.0
     
     new_counterparties = set()
     new_geographies = set()
@@ -127,22 +174,41 @@ def compute_deviation_analysis(transactions: List[Dict], baseline: Dict, flagged
     start_date = None
     end_date = None
 
+    # Single pass: volumes, new counterparties/geos/channels and date span
     for t in flagged_txns:
-        if t.get("counterparty_name") and t["counterparty_name"] not in usual_cps:
-            new_counterparties.add(t["counterparty_name"])
-        if t.get("counterparty_country") and t["counterparty_country"] not in usual_geos:
-            new_geographies.add(t["counterparty_country"])
-        if t.get("channel") and t["channel"] not in usual_chans:
-            new_channels.add(t["channel"])
+        amount = float(t["amount"])
+        if t.get("direction") == "inbound":
+            flagged_inflow += amount
+        else:
+            flagged_outflow += amount
+
+        cp_name = t.get("counterparty_name")
+        if cp_name and cp_name not in usual_cps:
+            new_counterparties.add(cp_name)
+        country = t.get("counterparty_country")
+        if country and country not in usual_geos:
+            new_geographies.add(country)
+        channel = t.get("channel")
+        if channel and channel not in usual_chans:
+            new_channels.add(channel)
             
-        try:
-            t_date = datetime.fromisoformat(t["date"].replace("Z", "+00:00"))
+        t_date = txn_dates.get(t["txn_id"])
+        if t_date is not None:
             if start_date is None or t_date < start_date:
                 start_date = t_date
             if end_date is None or t_date > end_date:
                 end_date = t_date
-        except:
-            pass
+
+    flagged_total_vol = flagged_inflow + flagged_outflow
+    
+    baseline_inflow = baseline.get("avg_monthly_inflow", 0.0)
+    baseline_outflow = baseline.get("avg_monthly_outflow", 0.0)
+    baseline_total_vol = baseline_inflow + baseline_outflow
+    
+    if baseline_total_vol > 0:
+        volume_deviation_factor = round(flagged_total_vol / baseline_total_vol, 1)
+    else:
+        volume_deviation_factor = 999.0 if flagged_total_vol > 0 else 0.0
             
     # Velocity spike check
     velocity_spike = False
@@ -180,75 +246,64 @@ def compute_deviation_analysis(transactions: List[Dict], baseline: Dict, flagged
         "new_geographies": list(new_geographies),
         "new_channels": list(new_channels),
         "deviation_summary": deviation_summary,
-        "flagged_txn_count": len(flagged_txns)
+        "flagged_txn_count": len(flagged_txns),
+        "flagged_volume": flagged_total_vol
     }
 
-def compute_cross_source_risk(case_input: Dict) -> Tuple[float, List[Dict]]:
+def _prior_sar_detail(prior_sars: List) -> str:
+    most_recent = prior_sars[0] # Assume list, take first
+    if isinstance(most_recent, dict):
+        return f"Prior SAR {most_recent.get('dcn', 'N/A')}"
+    return "Prior SAR history found"
+
+# Cross-source risk rules, evaluated in order:
+# (profile, key, test(value), points, factor, source, severity, detail(value))
+# profile is "risk_intel" (risk_intelligence) or "credit" (credit_profile).
+_RISK_RULES = (
+    # 1. Sanctions (+40)
+    ("risk_intel", "sanctions_hits", bool, 40, "Sanctions Hit", "Risk Intel", "high", lambda v: f"Hits: {len(v)}"),
+    # 2. PEP (+15)
+    ("risk_intel", "pep_status", bool, 15, "PEP Status", "Risk Intel", "high", lambda v: "Subject is PEP"),
+    # 3. Adverse Media (+10)
+    ("risk_intel", "adverse_media_hits", bool, 10, "Adverse Media", "Risk Intel", "medium", lambda v: f"Hits: {len(v)}"),
+    # 4. Prior SARs (+20)
+    ("risk_intel", "prior_sars", bool, 20, "Prior SARs", "Risk Intel", "high", _prior_sar_detail),
+    # 5. LE Requests (+15)
+    ("risk_intel", "law_enforcement_requests", lambda v: (v or 0) > 0, 15, "LE Request", "Risk Intel", "high", lambda v: "Law enforcement inquiry on file"),
+    # 6. Credit Deterioration (+5)
+    ("credit", "payment_history", lambda v: bool(v) and v != "current", 5, "Credit Deterioration", "Credit Bureau", "low", lambda v: f"Status: {v}"),
+    # 7. High Utilization (+3)
+    ("credit", "credit_card_utilization", lambda v: bool(v) and v > 0.80, 3, "High Utilization", "Credit Bureau", "low", lambda v: f"Utilization: {v:.2%}"),
+    # 8. Internal Referrals (+10)
+    ("risk_intel", "internal_referrals", bool, 10, "Internal Referral", "Internal", "medium", lambda v: "Referral on file"),
+)
+
+def compute_cross_source_risk(case_input: Dict, risk_intel: Optional[Dict] = None) -> Tuple[float, List[Dict]]:
     """
     Aggregate risk score from all sources (0-100).
     """
     score = 0.0
     factors = []
     
-    risk_intel = case_input.get("risk_intelligence") or {}
+    if risk_intel is None:
+        risk_intel = case_input.get("risk_intelligence") or {}
     alert = case_input.get("alert") or {}
     credit = case_input.get("credit_profile") or {}
     customer = case_input.get("customer_profile") or {}
     notes = case_input.get("investigator_notes")
+    profiles = {"risk_intel": risk_intel, "credit": credit}
     
-    # 1. Sanctions (+40)
-    if risk_intel.get("sanctions_hits"):
-        score += 40
-        factors.append({"factor": "Sanctions Hit", "source": "Risk Intel", "severity": "high", "detail": f"Hits: {len(risk_intel['sanctions_hits'])}"})
-
-    # 2. PEP (+15)
-    if risk_intel.get("pep_status"):
-        score += 15
-        factors.append({"factor": "PEP Status", "source": "Risk Intel", "severity": "high", "detail": "Subject is PEP"})
-
-    # 3. Adverse Media (+10)
-    if risk_intel.get("adverse_media_hits"):
-        score += 10
-        factors.append({"factor": "Adverse Media", "source": "Risk Intel", "severity": "medium", "detail": f"Hits: {len(risk_intel['adverse_media_hits'])}"})
-
-    # 4. Prior SARs (+20)
-    prior_sars = risk_intel.get("prior_sars", [])
-    if prior_sars:
-        score += 20
-        most_recent = prior_sars[0] # Assume list, take first
-        detail = "Prior SAR history found"
-        if isinstance(most_recent, dict):
-             detail = f"Prior SAR {most_recent.get('dcn', 'N/A')}"
-        factors.append({"factor": "Prior SARs", "source": "Risk Intel", "severity": "high", "detail": detail})
-
-    # 5. LE Requests (+15)
-    if risk_intel.get("law_enforcement_requests", 0) > 0:
-        score += 15
-        factors.append({"factor": "LE Request", "source": "Risk Intel", "severity": "high", "detail": "Law enforcement inquiry on file"})
-
-    # 6. Credit Deterioration (+5)
-    history = credit.get("payment_history", "current")
-    if history and history != "current":
-        score += 5
-        factors.append({"factor": "Credit Deterioration", "source": "Credit Bureau", "severity": "low", "detail": f"Status: {history}"})
-
-    # 7. High Utilization (+3)
-    util = credit.get("credit_card_utilization")
-    if util and util > 0.80:
-        score += 3
-        factors.append({"factor": "High Utilization", "source": "Credit Bureau", "severity": "low", "detail": f"Utilization: {util:.2%}"})
-        
-    # 8. Internal Referrals (+10)
-    if risk_intel.get("internal_referrals"):
-        score += 10
-        factors.append({"factor": "Internal Referral", "source": "Internal", "severity": "medium", "detail": "Referral on file"})
+    # 1-8. Table-driven rules
+    for profile, key, test, points, factor, source, severity, detail in _RISK_RULES:
+        value = profiles[profile].get(key)
+        if test(value):
+            score += points
+            factors.append({"factor": factor, "source": source, "severity": severity, "detail": detail(value)})
         
     # 9. Alert Risk Score (15%)
     alert_risk = float(alert.get("risk_score", 0))
     if alert_risk > 0:
-        added_risk = alert_risk * 0.15
-        score += added_risk
-        # factors.append({"factor": "Alert Risk", "source": "TMS", "severity": "variable", "detail": f"Base score: {alert_risk}"})
+        score += alert_risk * 0.15
 
     # 10. Notes Present (+5)
     if notes:
@@ -256,10 +311,8 @@ def compute_cross_source_risk(case_input: Dict) -> Tuple[float, List[Dict]]:
         factors.append({"factor": "Investigator Notes", "source": "Human", "severity": "medium", "detail": "Manual notes present"})
 
     # 11. Customer Risk Rating High (+8)
-    rating = customer.get("risk_rating") # raw dict key, might be 'customer_risk_rating' in schema but 'risk_rating' in json? 
-    # Check JSON structure: customer_profile has "risk_rating" in synth gen. Schema has customer_risk_rating. 
-    # The helper says "risk_rating" in prompt. Let's check both or just 'risk_rating' from raw dict.
-    if rating == "High" or customer.get("customer_risk_rating") == "High":
+    # Synthetic data uses "risk_rating"; the CustomerProfile schema uses "customer_risk_rating".
+    if customer.get("risk_rating") == "High" or customer.get("customer_risk_rating") == "High":
         score += 8
         factors.append({"factor": "High Risk Customer", "source": "KYC", "severity": "medium", "detail": "Rated High"})
 
@@ -297,6 +350,10 @@ def node1_ingest_enrich(state: Dict[str, Any]) -> Dict[str, Any]:
     alert = case_input.get("alert", {})
     customer = case_input.get("customer_profile", {})
     raw_txns = case_input.get("transaction_history", [])
+    risk_intel = case_input.get("risk_intelligence") or {}
+    prior_sars = risk_intel.get("prior_sars") or ()
+    sanctions_hits = risk_intel.get("sanctions_hits") or ()
+    adverse_media_hits = risk_intel.get("adverse_media_hits") or ()
     
     # 1. Deduplicate
     txns, dupes, quarantined = deduplicate_transactions(raw_txns)
@@ -305,14 +362,17 @@ def node1_ingest_enrich(state: Dict[str, Any]) -> Dict[str, Any]:
     alert_date_str = alert.get("generated_at", datetime.now().isoformat())
     flagged_ids = alert.get("flagged_transaction_ids", [])
     
+    # Parse transaction dates once for the baseline and deviation passes
+    txn_dates = parse_transaction_dates(txns)
+    
     # 3. Behavioral Baseline
-    baseline = compute_behavioral_baseline(txns, alert_date_str)
+    baseline, baseline_sets = compute_behavioral_baseline_with_sets(txns, alert_date_str, txn_dates)
     
     # 4. Deviation Analysis
-    deviations = compute_deviation_analysis(txns, baseline, flagged_ids)
+    deviations = compute_deviation_analysis(txns, baseline, flagged_ids, txn_dates, baseline_sets)
     
     # 5. Cross Source Risk
-    risk_score, risk_factors = compute_cross_source_risk(case_input)
+    risk_score, risk_factors = compute_cross_source_risk(case_input, risk_intel)
 
     # Build Dossier
     enriched_dossier = {
@@ -327,11 +387,11 @@ def node1_ingest_enrich(state: Dict[str, Any]) -> Dict[str, Any]:
         "risk_factors": risk_factors,
         
         # Booleans
-        "has_prior_sars": len(case_input.get("risk_intelligence", {}).get("prior_sars", [])) > 0,
-        "prior_sar_count": len(case_input.get("risk_intelligence", {}).get("prior_sars", [])),
-        "is_pep": case_input.get("risk_intelligence", {}).get("pep_status", False),
-        "has_sanctions_hits": len(case_input.get("risk_intelligence", {}).get("sanctions_hits", [])) > 0,
-        "has_adverse_media": len(case_input.get("risk_intelligence", {}).get("adverse_media_hits", [])) > 0,
+        "has_prior_sars": bool(prior_sars),
+        "prior_sar_count": len(prior_sars),
+        "is_pep": risk_intel.get("pep_status", False),
+        "has_sanctions_hits": bool(sanctions_hits),
+        "has_adverse_media": bool(adverse_media_hits),
         
         "enrichment_timestamp": datetime.utcnow().isoformat(),
         "sources_consulted": ["TMS", "KYC", "Credit Bureau", "Watchlist", "Internal History"],
@@ -1,21 +1,32 @@
 import os
 import json
+from bisect import bisect_left, bisect_right
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, Any, List, Optional, Tuple
 
-def _get_year(date_str: str) -> int:
-    try:
-        return datetime.fromisoformat(date_str.replace("Z", "+00:00")).year
-    except:
-        return 0
+from agents.node1_ingest_enrich import parse_iso_datetime
 
-def _get_month(date_str: str) -> int:
+HIGH_RISK_GEOS = frozenset({"AE", "KY", "PA", "BZ", "VG", "BS", "LR"})
+PAYROLL_KEYWORDS = ("salary", "bonus", "payroll", "compensation")
+
+def _get_year_month(date_str: str) -> Tuple[int, int]:
     try:
-        return datetime.fromisoformat(date_str.replace("Z", "+00:00")).month
+        d = parse_iso_datetime(date_str)
+        return d.year, d.month
     except:
-        return 0
+        return 0, 0
 
-def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[str], Optional[str]]:
+def index_transactions(txns: List[Dict]) -> Dict[str, Dict]:
+    """
+    Map txn_id -> transaction. The first occurrence wins for duplicated IDs.
+    """
+    txn_by_id = {}
+    for t in txns:
+        txn_by_id.setdefault(t["txn_id"], t)
+    return txn_by_id
+
+def apply_rule_based_triage(case_input: Dict, dossier: Dict, txn_by_id: Optional[Dict[str, Dict]] = None, flagged_set: Optional[frozenset] = None) -> Tuple[Optional[str], Optional[str]]:
     """
     Layer 1: Hard rules. Returns (classification, rule_id) or (None, None).
     """
@@ -23,6 +34,10 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
     alert = case_input.get("alert", {})
     txns = case_input.get("transaction_history", [])
     flagged_ids = alert.get("flagged_transaction_ids", [])
+    if txn_by_id is None:
+        txn_by_id = index_transactions(txns)
+    if flagged_set is None:
+        flagged_set = frozenset(flagged_ids)
     
     # Rule 1 - SANC-001: Sanctions Hits
     if risk_intel.get("sanctions_hits"):
@@ -36,7 +51,7 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
 
     # Rule 3 - SAL-001: Salary/Bonus False Positive
     if len(flagged_ids) == 1:
-        flagged_txn = next((t for t in txns if t["txn_id"] == flagged_ids[0]), None)
+        flagged_txn = txn_by_id.get(flagged_ids[0])
         employer = case_input.get("customer_profile", {}).get("employer", "").lower()
         
         if flagged_txn and employer:
@@ -44,7 +59,7 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
             memo = (flagged_txn.get("memo") or "").lower()
             
             is_employer_match = employer in cp_name
-            is_payroll = any(kw in memo for kw in ["salary", "bonus", "payroll", "compensation"])
+            is_payroll = any(kw in memo for kw in PAYROLL_KEYWORDS)
             
             # check historical similarity
             output_txns = [t for t in txns if t["txn_id"] != flagged_ids[0]]
@@ -56,31 +71,27 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
     # Rule 4 - SEAS-001: Seasonal Spike
     if vol_dev > 2.0:
         # Check prior year same months
-        # Get flagged months
+        # Get flagged months; assume alert year is max year in flagged
         flagged_months = set()
+        alert_year = 0
         for fid in flagged_ids:
-            t = next((tx for tx in txns if tx["txn_id"] == fid), None)
+            t = txn_by_id.get(fid)
             if t:
-                m = _get_month(t["date"])
+                y, m = _get_year_month(t["date"])
                 flagged_months.add(m)
+                if y > alert_year: alert_year = y
+        flagged_months = frozenset(flagged_months)
         
         # Check prior year volume for these months
         if flagged_months:
-            # Assume alert year is max year in flagged
-            alert_year = 0
-            for fid in flagged_ids:
-                t = next((tx for tx in txns if tx["txn_id"] == fid), None)
-                if t:
-                    y = _get_year(t["date"])
-                    if y > alert_year: alert_year = y
-            
             prior_year = alert_year - 1
-            prior_year_txns = [
-                t for t in txns 
-                if _get_year(t["date"]) == prior_year 
-                and _get_month(t["date"]) in flagged_months
-                and t.get("direction") == "inbound"
-            ]
+            prior_year_txns = []
+            for t in txns:
+                if t.get("direction") != "inbound":
+                    continue
+                y, m = _get_year_month(t["date"])
+                if y == prior_year and m in flagged_months:
+                    prior_year_txns.append(t)
             
             prior_vol = sum(t["amount"] for t in prior_year_txns)
             prior_count = len(prior_year_txns)
@@ -88,7 +99,7 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
             # Current flagged volume
             flagged_inbound_vol = sum(
                 t["amount"] for t in txns 
-                if t["txn_id"] in flagged_ids and t.get("direction") == "inbound"
+                if t["txn_id"] in flagged_set and t.get("direction") == "inbound"
             )
             
             if prior_count > 20 and prior_vol > 0:
@@ -98,73 +109,105 @@ def apply_rule_based_triage(case_input: Dict, dossier: Dict) -> Tuple[Optional[s
 
     return None, None
 
-def compute_behavioral_anomaly_score(case_input: Dict, dossier: Dict) -> float:
+# Scoring tables for _anomaly_score_core: score = SCORES[bisect(THRESHOLDS, value)]
+# "value > threshold" cascades use bisect_left, "value < threshold" use bisect_right.
+_VOL_DEV_THRESHOLDS = (1.5, 2, 3, 5, 8)
+_VOL_DEV_SCORES = (0, 8, 15, 20, 25, 30)
+_NEW_CP_THRESHOLDS = (2, 5, 10, 20)
+_NEW_CP_SCORES = (0, 5, 10, 15, 20)
+_ACCOUNT_AGE_THRESHOLDS = (90, 180, 365)
+_ACCOUNT_AGE_SCORES = (10, 7, 3, 0)
+_INCOME_RATIO_THRESHOLDS = (1, 2, 5)
+_INCOME_RATIO_SCORES = (0, 5, 10, 15)
+
+def _anomaly_score_core(
+    vol_dev: float,
+    new_cps: int,
+    velocity_spike: bool,
+    new_geo_count: int,
+    high_risk_geo_hit: bool,
+    age_days: Optional[int],
+    income: float,
+    flagged_vol: float
+) -> float:
     """
-    Layer 2: Scoring 0-100 based on anomalies.
+    Numeric scoring cascade for the behavioral anomaly score, on plain scalars.
     """
     score = 0.0
-    deviation = dossier.get("deviation_analysis", {})
-    customer = case_input.get("customer_profile", {})
-    alert = case_input.get("alert", {})
     
     # 1. Volume Deviation (0-30)
-    vol_dev = deviation.get("volume_deviation_factor", 0.0)
-    if vol_dev > 8: score += 30
-    elif vol_dev > 5: score += 25
-    elif vol_dev > 3: score += 20
-    elif vol_dev > 2: score += 15
-    elif vol_dev > 1.5: score += 8
+    score += _VOL_DEV_SCORES[bisect_left(_VOL_DEV_THRESHOLDS, vol_dev)]
     
     # 2. New Counterparties (0-20)
-    new_cps = deviation.get("new_counterparties_count", 0)
-    if new_cps > 20: score += 20
-    elif new_cps > 10: score += 15
-    elif new_cps > 5: score += 10
-    elif new_cps > 2: score += 5
+    score += _NEW_CP_SCORES[bisect_left(_NEW_CP_THRESHOLDS, new_cps)]
     
     # 3. Velocity Spike (0-15)
-    if deviation.get("velocity_spike"):
+    if velocity_spike:
         score += 15
         
     # 4. New Geographies (0-10)
-    new_geos = deviation.get("new_geographies", [])
-    high_risk = {"AE", "KY", "PA", "BZ", "VG", "BS", "LR"}
-    if any(g in high_risk for g in new_geos):
+    if high_risk_geo_hit:
         score += 10
-    elif new_geos:
+    elif new_geo_count:
         score += 5
         
     # 5. Account Age (0-10)
+    if age_days is not None:
+        score += _ACCOUNT_AGE_SCORES[bisect_right(_ACCOUNT_AGE_THRESHOLDS, age_days)]
+            
+    # 6. Income Mismatch (0-15)
+    if income > 0:
+        ratio = flagged_vol / income
+        score += _INCOME_RATIO_SCORES[bisect_left(_INCOME_RATIO_THRESHOLDS, ratio)]
+    elif flagged_vol > 100000:
+        score += 15
+        
+    return min(score, 100.0)
+
+def compute_behavioral_anomaly_score(case_input: Dict, dossier: Dict, flagged_set: Optional[frozenset] = None) -> float:
+    """
+    Layer 2: Scoring 0-100 based on anomalies.
+    Extracts the scalar inputs from the case and delegates to _anomaly_score_core.
+    """
+    deviation = dossier.get("deviation_analysis", {})
+    customer = case_input.get("customer_profile", {})
+    alert = case_input.get("alert", {})
+    
+    new_geos = deviation.get("new_geographies", [])
+    high_risk_geo_hit = not HIGH_RISK_GEOS.isdisjoint(new_geos)
+    
+    # Account age in days (None if unknown)
+    age_days = None
     opened = customer.get("account_opened_date") # YYYY-MM-DD
     if opened:
         try:
             open_dt = datetime.strptime(opened, "%Y-%m-%d")
-            alert_dt = datetime.fromisoformat(alert.get("generated_at", datetime.now().isoformat()).replace("Z", "+00:00"))
+            alert_dt = parse_iso_datetime(alert.get("generated_at", datetime.now().isoformat()))
             age_days = (alert_dt - open_dt.replace(tzinfo=alert_dt.tzinfo)).days
-            
-            if age_days < 90: score += 10
-            elif age_days < 180: score += 7
-            elif age_days < 365: score += 3
         except:
             pass
             
-    # 6. Income Mismatch (0-15)
     income = float(customer.get("annual_income", 0.0))
-    flagged_ids = alert.get("flagged_transaction_ids", [])
-    txns = case_input.get("transaction_history", [])
-    flagged_vol = sum(t["amount"] for t in txns if t["txn_id"] in flagged_ids)
+    # Flagged volume is totalled by node 1's deviation pass; recompute only if absent
+    flagged_vol = deviation.get("flagged_volume")
+    if flagged_vol is None:
+        if flagged_set is None:
+            flagged_set = frozenset(alert.get("flagged_transaction_ids", []))
+        txns = case_input.get("transaction_history", [])
+        flagged_vol = sum(t["amount"] for t in txns if t["txn_id"] in flagged_set)
     
-    if income > 0:
-        ratio = flagged_vol / income
-        if ratio > 5: score += 15
-        elif ratio > 2: score += 10
-        elif ratio > 1: score += 5
-    elif flagged_vol > 100000:
-        score += 15
-        
-    return min(score, 100.0)
+    return _anomaly_score_core(
+        vol_dev=deviation.get("volume_deviation_factor", 0.0),
+        new_cps=deviation.get("new_counterparties_count", 0),
+        velocity_spike=bool(deviation.get("velocity_spike")),
+        new_geo_count=len(new_geos),
+        high_risk_geo_hit=high_risk_geo_hit,
+        age_days=age_days,
+        income=income,
+        flagged_vol=flagged_vol
+    )
 
-def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
+def classify_typology(case_input: Dict, dossier: Dict, txn_by_id: Optional[Dict[str, Dict]] = None) -> Dict:
     """
     Determine typology for True Positives.
     """
@@ -173,6 +216,8 @@ def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
     alert = case_input.get("alert", {})
     txns = case_input.get("transaction_history", [])
     flagged_ids = alert.get("flagged_transaction_ids", [])
+    if txn_by_id is None:
+        txn_by_id = index_transactions(txns)
     deviation = dossier.get("deviation_analysis", {})
     customer = case_input.get("customer_profile", {})
     alert_type = alert.get("alert_type", "").lower()
@@ -184,16 +229,24 @@ def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
     if deviation.get("new_counterparties_count", 0) > 10: s_indicators += 1
     if deviation.get("volume_deviation_factor", 0.0) > 3: s_indicators += 1
     
-    # International wire check in flagged
+    # Flagged transaction indicators, in one pass:
+    # international wire (structuring) and cash withdrawal (funnel)
     has_intl_wire = False
+    has_cash_out = False
     for fid in flagged_ids:
-        t = next((tx for tx in txns if tx["txn_id"] == fid), None)
-        if t:
-            is_wire = "wire" in t.get("type", "").lower()
+        t = txn_by_id.get(fid)
+        if not t:
+            continue
+        txn_type = t.get("type", "")
+        if not has_intl_wire and "wire" in txn_type.lower():
             country = t.get("counterparty_country")
-            if is_wire and country and country != "US":
+            if country and country != "US":
                 has_intl_wire = True
-                break
+        if not has_cash_out and "cash_withdrawal" in txn_type:
+            has_cash_out = True
+        if has_intl_wire and has_cash_out:
+            break
+    
     if has_intl_wire: s_indicators += 1
     
     if s_indicators >= 2:
@@ -218,7 +271,7 @@ def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
     if opened:
         try:
             open_dt = datetime.strptime(opened, "%Y-%m-%d")
-            alert_dt = datetime.fromisoformat(alert.get("generated_at", datetime.now().isoformat()).replace("Z", "+00:00"))
+            alert_dt = parse_iso_datetime(alert.get("generated_at", datetime.now().isoformat()))
             if (alert_dt - open_dt.replace(tzinfo=alert_dt.tzinfo)).days < 180:
                 is_young = True
         except: pass
@@ -230,10 +283,6 @@ def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
     if income == 0 or "student" in occ: f_indicators += 1
     
     # Cash withdrawal
-    has_cash_out = any(
-        "cash_withdrawal" in next((t.get("type", "") for t in txns if t["txn_id"] == fid), "") 
-        for fid in flagged_ids
-    )
     if has_cash_out: f_indicators += 1
     
     if deviation.get("new_counterparties_count", 0) > 5: f_indicators += 1
@@ -257,8 +306,20 @@ def classify_typology(case_input: Dict, dossier: Dict) -> Dict:
         "assessment_timestamp": datetime.utcnow().isoformat()
     }
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+@lru_cache(maxsize=256)
+def _invoke_llm_reasoning(prompt: str, api_key: str) -> str:
+    """
+    Run the triage reasoning prompt. Memoized on the prompt text so replayed
+    alerts (e.g. backtests, UI reruns) don't repeat the network call.
+    Failed calls raise and are not cached.
+    """
+    # Imported lazily: LangChain is slow to import and only needed when an API key is set
+    from langchain_openai import ChatOpenAI
+    from langchain_core.messages import HumanMessage
+    
+    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, max_tokens=500, api_key=api_key)
+    response = llm.invoke([HumanMessage(content=prompt)])
+    return response.content
 
 def get_llm_reasoning(case_input: Dict, dossier: Dict) -> Optional[str]:
     api_key = os.environ.get("OPENAI_API_KEY")
@@ -266,8 +327,6 @@ def get_llm_reasoning(case_input: Dict, dossier: Dict) -> Optional[str]:
         return None
         
     try:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, max_tokens=500, api_key=api_key)
-        
         alert = case_input.get("alert", {})
         customer = case_input.get("customer_profile", {})
         deviation = dossier.get("deviation_analysis", {})
@@ -289,8 +348,7 @@ def get_llm_reasoning(case_input: Dict, dossier: Dict) -> Optional[str]:
         Assess if this looks like TRUE_POSITIVE (suspicious) or FALSE_POSITIVE (explainable) or NEEDS_REVIEW.
         """
         
-        response = llm.invoke([HumanMessage(content=prompt)])
-        return response.content
+        return _invoke_llm_reasoning(prompt, api_key)
         
     except Exception as e:
         print(f"LLM Error: {e}")
@@ -303,11 +361,15 @@ def node2_triage_classify(state: Dict[str, Any]) -> Dict[str, Any]:
     dossier = state.get("enriched_dossier", {})
     alert = case_input.get("alert", {})
     
+    # Index transactions once for the rule, scoring and typology layers
+    txn_by_id = index_transactions(case_input.get("transaction_history", []))
+    flagged_set = frozenset(alert.get("flagged_transaction_ids", []))
+    
     # Layer 1: Rules
-    rule_class, rule_id = apply_rule_based_triage(case_input, dossier)
+    rule_class, rule_id = apply_rule_based_triage(case_input, dossier, txn_by_id, flagged_set)
     
     # Layer 2: Behavioral Score
-    beh_score = compute_behavioral_anomaly_score(case_input, dossier)
+    beh_score = compute_behavioral_anomaly_score(case_input, dossier, flagged_set)
     
     # Composite Score
     risk_score = dossier.get("cross_source_risk_score", 0.0)
@@ -335,10 +397,15 @@ def node2_triage_classify(state: Dict[str, Any]) -> Dict[str, Any]:
     # Typology
     typology_assessment = None
     if classification == "TRUE_POSITIVE":
-        typology_assessment = classify_typology(case_input, dossier)
+        typology_assessment = classify_typology(case_input, dossier, txn_by_id)
         if typology_assessment:
             explanation += f" Primary typology: {typology_assessment['primary_typology']}."
 
+    if rule_id:
+        rule_factor = {"factor": "Rule Match", "weight": "Critical", "direction": str(rule_id), "evidence": f"Triggered rule {rule_id}"}
+    else:
+        rule_factor = {"factor": "Rule Match", "weight": "None", "direction": "None", "evidence": "No hard rules matched."}
+
     triage_decision = {
         "unified_alert_id": alert.get("alert_id"),
         "classification": classification,
@@ -352,8 +419,8 @@ def node2_triage_classify(state: Dict[str, Any]) -> Dict[str, Any]:
         "triage_timestamp": datetime.utcnow().isoformat(),
         "rules_evaluated": 4,
         "decision_factors": [
-            {"factor": "Behavioral Anomaly Score", "weight": "High", "direction": f"{beh_score}/100", "evidence": f"Score based on volume/velocity deviations."},
-            {"factor": "Rule Match", "weight": "Critical", "direction": str(rule_id), "evidence": f"Triggered rule {rule_id}"} if rule_id else {"factor": "Rule Match", "weight": "None", "direction": "None", "evidence": "No hard rules matched."},
+            {"factor": "Behavioral Anomaly Score", "weight": "High", "direction": f"{beh_score}/100", "evidence": "Score based on volume/velocity deviations."},
+            rule_factor,
             {"factor": "Composite Risk Score", "weight": "High", "direction": f"{composite_score:.1f}/100", "evidence": "Combined risk assessment."}
         ]
     }
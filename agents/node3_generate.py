@@ -1,8 +1,11 @@
 import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import os
 import json
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 # Load env vars
@@ -10,7 +13,8 @@ load_dotenv()
 
 # RAG Imports
 try:
-    from rag.setup_vectorstore import get_vectorstore, query_vectorstore
+    from rag.setup_vectorstore import add_reindex_listener, get_vectorstore
+    from rag.semantic_cache import SEMANTIC_CACHE_TTL_SECONDS, query_vectorstore_semantic_batch
     HAS_RAG_LIB = True
 except ImportError:
     HAS_RAG_LIB = False
@@ -24,41 +28,76 @@ try:
 except ImportError:
     HAS_LANGCHAIN = False
 
+_FALLBACK_RAG_CONTEXT = [
+    "SAR Narrative Structure: 1. Introduction/Subject, 2. Summary of Activity, 3. Analysis, 4. Conclusion.",
+    "Include 5Ws: Who, What, Where, When, Why."
+]
+
+# In-process LRU cache of retrieved context, keyed by (typology_name, alert_type);
+# entries expire on the same schedule as the semantic query cache behind it
+RAG_CACHE_MAXSIZE = 512
+RAG_CACHE_TTL_SECONDS = SEMANTIC_CACHE_TTL_SECONDS if HAS_RAG_LIB else 3600.0
+_rag_cache: "OrderedDict[Tuple[str, str], Tuple[float, List[str]]]" = OrderedDict()
+_rag_cache_lock = threading.Lock()
+
+def clear_rag_cache() -> None:
+    with _rag_cache_lock:
+        _rag_cache.clear()
+
+if HAS_RAG_LIB:
+    # A corpus re-index invalidates every cached context
+    add_reindex_listener(clear_rag_cache)
+
+def _query_rag_context(typology_name: str, alert_type: str) -> List[str]:
+    # Get/Create vectorstore (uses simple embeddings fallback if needed)
+    vs = get_vectorstore()
+    
+    queries = [
+        f"SAR narrative structure {typology_name}",
+        f"5W How framework {alert_type} suspicious activity",
+        f"{typology_name} indicators red flags"
+    ]
+    
+    # One embedding round trip for all three queries
+    context_set = set()
+    for results in query_vectorstore_semantic_batch(vs, queries, k=2):
+        context_set.update(results)
+            
+    print(f"[RAG] Retrieved {len(context_set)} unique context chunks.")
+    return list(context_set)
+
 def retrieve_rag_context(typology_name: str, alert_type: str) -> List[str]:
     """
     Retrieve relevant regulatory guidance via RAG.
+    Results are cached per (typology, alert_type) for RAG_CACHE_TTL_SECONDS.
     """
     if not HAS_RAG_LIB:
-        return [
-            "SAR Narrative Structure: 1. Introduction/Subject, 2. Summary of Activity, 3. Analysis, 4. Conclusion.",
-            "Include 5Ws: Who, What, Where, When, Why."
-        ]
-        
-    try:
-        # Get/Create vectorstore (uses simple embeddings fallback if needed)
-        vs = get_vectorstore()
+        return list(_FALLBACK_RAG_CONTEXT)
         
-        queries = [
-            f"SAR narrative structure {typology_name}",
-            f"5W How framework {alert_type} suspicious activity",
-            f"{typology_name} indicators red flags"
-        ]
-        
-        context_set = set()
-        for q in queries:
-            results = query_vectorstore(vs, q, k=2)
-            for res in results:
-                context_set.add(res)
-                
-        print(f"[RAG] Retrieved {len(context_set)} unique context chunks.")
-        return list(context_set)
+    key = (typology_name, alert_type)
+    now = time.monotonic()
+    with _rag_cache_lock:
+        cached = _rag_cache.get(key)
+        if cached is not None and now - cached[0] < RAG_CACHE_TTL_SECONDS:
+            _rag_cache.move_to_end(key)
+            print(f"[RAG] Cache hit for {key}.")
+            return list(cached[1])
         
+    try:
+        context = _query_rag_context(typology_name, alert_type)
     except Exception as e:
         print(f"[RAG] Error retrieving context: {e}")
-        return [
-            "SAR Narrative Structure: 1. Introduction/Subject, 2. Summary of Activity, 3. Analysis, 4. Conclusion.",
-            "Include 5Ws: Who, What, Where, When, Why."
-        ]
+        return list(_FALLBACK_RAG_CONTEXT)
+        
+    with _rag_cache_lock:
+        _rag_cache[key] = (now, context)
+        _rag_cache.move_to_end(key)
+        while len(_rag_cache) > RAG_CACHE_MAXSIZE:
+            _rag_cache.popitem(last=False)
+    return list(context)
+
+# Same clearing hook as an lru_cache-wrapped function, for tests
+retrieve_rag_context.cache_clear = clear_rag_cache
 
 def build_evidence_summary(state: Dict) -> str:
     """
@@ -75,12 +114,25 @@ def build_evidence_summary(state: Dict) -> str:
     
     # Txn stats
     txns = case.get("transaction_history", [])
-    flagged_ids = alert.get("flagged_transaction_ids", [])
-    flagged_txns = [t for t in txns if t["txn_id"] in flagged_ids]
+    flagged_ids = set(alert.get("flagged_transaction_ids", []))
     
-    total_in = sum(t["amount"] for t in flagged_txns if t.get("direction") == "inbound")
-    total_out = sum(t["amount"] for t in flagged_txns if t.get("direction") == "outbound")
-    countries = sorted(list(set(t.get("counterparty_country", "Unknown") for t in flagged_txns if t.get("counterparty_country"))))
+    # Single pass over the history for count, totals and countries
+    flagged_count = 0
+    total_in = total_out = 0.0
+    countries = set()
+    for t in txns:
+        if t["txn_id"] not in flagged_ids:
+            continue
+        flagged_count += 1
+        direction = t.get("direction")
+        if direction == "inbound":
+            total_in += t["amount"]
+        elif direction == "outbound":
+            total_out += t["amount"]
+        country = t.get("counterparty_country")
+        if country:
+            countries.add(country)
+    countries = sorted(countries)
     
     summary = f"""
     ALERT DETAILS:
@@ -110,7 +162,7 @@ def build_evidence_summary(state: Dict) -> str:
     - Baseline Avg Inflow: ${dossier.get("behavioral_baseline", {}).get("avg_monthly_inflow", 0):,.2f}
     
     TRANSACTION ACTIVITY (Flagged):
-    - Count: {len(flagged_txns)}
+    - Count: {flagged_count}
     - Total Inflow: ${total_in:,.2f}
     - Total Outflow: ${total_out:,.2f}
     - Involved Countries: {", ".join(countries)}
@@ -153,6 +205,110 @@ def generate_narrative_fallback(evidence_summary: str, typology: str, case_input
         "rag_chunks_used": 0
     }
 
+# SAR narrative system prompt; encoded once for prompt hashing
+_SYSTEM_PROMPT = """
+You are an expert BSA/AML compliance analyst drafting a SAR narrative. Follow FinCEN guidelines strictly. 
+Use the 5W+How framework. Write in formal regulatory language. 
+Every claim must be supported by the evidence provided. 
+Do NOT conclude that money laundering has occurred — describe why the activity APPEARS suspicious. 
+Use specific dollar amounts, dates, and transaction counts. 
+Structure the narrative with these sections:
+
+SUBJECT INFORMATION
+SUMMARY OF SUSPICIOUS ACTIVITY
+DETAILED TRANSACTION ANALYSIS
+FLOW OF FUNDS
+SUSPICION RATIONALE
+PRIOR HISTORY (if applicable)
+ACTIONS TAKEN
+"""
+_SYSTEM_PROMPT_BYTES = _SYSTEM_PROMPT.encode()
+
+# Section headers recognised when parsing the LLM narrative
+_SECTION_HEADERS = frozenset({
+    "SUBJECT INFORMATION", "SUMMARY OF SUSPICIOUS ACTIVITY", "DETAILED TRANSACTION ANALYSIS",
+    "FLOW OF FUNDS", "SUSPICION RATIONALE", "PRIOR HISTORY", "ACTIONS TAKEN"
+})
+_MAX_SECTION_HEADER_LEN = max(len(h) for h in _SECTION_HEADERS)
+
+LLM_MODEL = "gpt-4o-mini"
+LLM_TEMPERATURE = 0.2
+
+# In-process LRU cache of LLM narrative text, keyed by (prompt_hash, model, temperature)
+LLM_CACHE_MAXSIZE = 128
+_llm_cache: "OrderedDict[Tuple[str, str, float], str]" = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+def _llm_cache_get(key: Tuple[str, str, float]) -> Optional[str]:
+    with _llm_cache_lock:
+        text = _llm_cache.get(key)
+        if text is not None:
+            _llm_cache.move_to_end(key)
+        return text
+
+def _llm_cache_put(key: Tuple[str, str, float], text: str) -> None:
+    with _llm_cache_lock:
+        _llm_cache[key] = text
+        _llm_cache.move_to_end(key)
+        while len(_llm_cache) > LLM_CACHE_MAXSIZE:
+            _llm_cache.popitem(last=False)
+
+def clear_llm_cache() -> None:
+    with _llm_cache_lock:
+        _llm_cache.clear()
+
+# Shared ChatOpenAI client, so the HTTP connection pool is kept alive between calls
+_llm_client = None
+_llm_client_key = None
+_llm_client_lock = threading.Lock()
+
+def _get_llm(api_key: str):
+    global _llm_client, _llm_client_key
+    with _llm_client_lock:
+        if _llm_client is None or _llm_client_key != api_key:
+            _llm_client = ChatOpenAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE, max_tokens=3000, api_key=api_key)
+            _llm_client_key = api_key
+        return _llm_client
+
+def _parse_sections(lines) -> List[Dict]:
+    """
+    Split narrative lines into sections at the known headers (simplified).
+    Accepts any iterable, so it can consume lines while the LLM is still streaming.
+    """
+    sections = []
+    current_section = None
+    buffer = []
+    
+    for line in lines:
+        stripped = line.strip()
+        # Body lines longer than any header can't be one; skip the upper() copy
+        upper_line = stripped.upper() if len(stripped) <= _MAX_SECTION_HEADER_LEN else None
+        if upper_line in _SECTION_HEADERS:
+            if current_section:
+                sections.append({"section_name": current_section, "content": "\n".join(buffer).strip()})
+            current_section = upper_line
+            buffer = []
+        else:
+            buffer.append(line)
+    if current_section:
+        sections.append({"section_name": current_section, "content": "\n".join(buffer).strip()})
+    return sections
+
+def _stream_llm_lines(llm, messages, parts: List[str]):
+    """
+    Stream the LLM response, yielding each complete line as soon as it arrives.
+    Raw chunks are collected into `parts`; the lines match full_text.split("\n").
+    """
+    pending = ""
+    for chunk in llm.stream(messages):
+        piece = chunk.content
+        parts.append(piece)
+        pending += piece
+        if "\n" in piece:
+            *complete, pending = pending.split("\n")
+            yield from complete
+    yield pending
+
 def generate_narrative_with_llm(evidence_summary: str, rag_context: List[str], typology: str, case_input: Dict) -> Dict:
     """
     Generate narrative using GPT-4o-mini via LangChain.
@@ -163,55 +319,32 @@ def generate_narrative_with_llm(evidence_summary: str, rag_context: List[str], t
         return generate_narrative_fallback(evidence_summary, typology, case_input)
         
     try:
-        print("[Node 3] Calling LLM for narrative generation...")
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, max_tokens=3000, api_key=api_key)
-        
-        system_prompt = """
-        You are an expert BSA/AML compliance analyst drafting a SAR narrative. Follow FinCEN guidelines strictly. 
-        Use the 5W+How framework. Write in formal regulatory language. 
-        Every claim must be supported by the evidence provided. 
-        Do NOT conclude that money laundering has occurred — describe why the activity APPEARS suspicious. 
-        Use specific dollar amounts, dates, and transaction counts. 
-        Structure the narrative with these sections:
-
-        SUBJECT INFORMATION
-        SUMMARY OF SUSPICIOUS ACTIVITY
-        DETAILED TRANSACTION ANALYSIS
-        FLOW OF FUNDS
-        SUSPICION RATIONALE
-        PRIOR HISTORY (if applicable)
-        ACTIONS TAKEN
-        """
-        
         context_str = "\n\n".join(rag_context)
         user_prompt = f"REGULATORY GUIDANCE:\n{context_str}\n\nEVIDENCE PACKAGE:\n{evidence_summary}\n\nGenerate a complete SAR narrative for this case. Be specific with all amounts, dates, and counts."
         
-        # Hash prompt for audit
-        prompt_hash = hashlib.md5((system_prompt + user_prompt).encode()).hexdigest()
-        
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        full_text = response.content
-        
-        # Parse sections (simplified)
-        sections = []
-        current_section = None
-        buffer = []
+        # Hash prompt for audit (SHA-256, fed in parts to avoid concatenating the prompts)
+        hasher = hashlib.sha256()
+        hasher.update(_SYSTEM_PROMPT_BYTES)
+        hasher.update(user_prompt.encode())
+        prompt_hash = hasher.hexdigest()
         
-        for line in full_text.split("\n"):
-            upper_line = line.strip().upper()
-            if upper_line in ["SUBJECT INFORMATION", "SUMMARY OF SUSPICIOUS ACTIVITY", "DETAILED TRANSACTION ANALYSIS", "FLOW OF FUNDS", "SUSPICION RATIONALE", "PRIOR HISTORY", "ACTIONS TAKEN"]:
-                if current_section:
-                    sections.append({"section_name": current_section, "content": "\n".join(buffer).strip()})
-                current_section = upper_line
-                buffer = []
-            else:
-                buffer.append(line)
-        if current_section:
-            sections.append({"section_name": current_section, "content": "\n".join(buffer).strip()})
+        # Identical prompts (replays, re-runs of a case) reuse the earlier response
+        cache_key = (prompt_hash, LLM_MODEL, LLM_TEMPERATURE)
+        full_text = _llm_cache_get(cache_key)
+        if full_text is None:
+            print("[Node 3] Calling LLM for narrative generation...")
+            llm = _get_llm(api_key)
+            # Stream the response so section parsing overlaps with token decoding
+            parts = []
+            sections = _parse_sections(_stream_llm_lines(llm, [
+                SystemMessage(content=_SYSTEM_PROMPT),
+                HumanMessage(content=user_prompt)
+            ], parts))
+            full_text = "".join(parts)
+            _llm_cache_put(cache_key, full_text)
+        else:
+            print(f"[Node 3] LLM response cache hit ({prompt_hash[:12]}).")
+            sections = _parse_sections(full_text.split("\n"))
             
         # Determine filing type
         prior_sars = case_input.get("risk_intelligence", {}).get("prior_sars", [])
@@ -224,7 +357,7 @@ def generate_narrative_with_llm(evidence_summary: str, rag_context: List[str], t
             "full_narrative": full_text,
             "sections": sections,
             "word_count": len(full_text.split()),
-            "generation_model": "gpt-4o-mini",
+            "generation_model": LLM_MODEL,
             "generation_timestamp": datetime.datetime.utcnow().isoformat(),
             "prompt_hash": prompt_hash,
             "rag_chunks_used": len(rag_context)
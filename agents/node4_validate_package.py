@@ -3,12 +3,54 @@ from typing import Dict, Any, List, Optional
 import json
 import re
 
+import ahocorasick
+
+# Version stamped into every audit package
+PIPELINE_VERSION = "STRATIFY v0.1"
+
+# Regex for dates: YYYY-MM-DD, MM/DD/YYYY, or Month names
+_DATE_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|january|february|march|april|may|june|july|august|september|october|november|december)",
+    re.IGNORECASE
+)
+# $X, USD X, or strict numbers
+_AMOUNT_RE = re.compile(r"(\$|usd|eur)\s?\d{1,3}(,\d{3})*(\.\d{2})?", re.IGNORECASE)
+_COUNT_RE = re.compile(r"\d+\s(transactions|deposits|withdrawals|wires|transfers)", re.IGNORECASE)
+
+# Keyword sets for the WHAT / WHERE / WHY / HOW / PRIOR / DEFINITIVE checks
+_KEYWORDS = {
+    "what": ("structuring", "layering"),
+    "loc": ("branch", "state", "country", "jurisdiction", "bank", "location"),
+    "susp": ("suspicious", "inconsistent", "deviation", "unusual", "anomal", "red flag", "indicator", "appears"),
+    "mech": ("deposit", "withdraw", "wire", "transfer", "cash", "fund", "transaction"),
+    "prior": ("prior", "previous", "filing", "continuing", "dcn"),
+    "def": ("is guilty", "committed money laundering", "is laundering money", "illegal activity confirmed"),
+}
+
+_KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for _cat, _terms in _KEYWORDS.items():
+    for _term in _terms:
+        _KEYWORD_AUTOMATON.add_word(_term, (_cat, _term))
+_KEYWORD_AUTOMATON.make_automaton()
+
+def scan_keywords(text: str) -> Dict[str, set]:
+    """
+    Find which keywords of each category occur in (lowercased) text.
+    Uses a single Aho-Corasick pass over the text for all categories.
+    """
+    found = {cat: set() for cat in _KEYWORDS}
+    for _, (cat, term) in _KEYWORD_AUTOMATON.iter(text):
+        found[cat].add(term)
+    return found
+
 def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     """
     Validate the generated SAR narrative against FinCEN's 5W+How framework.
     """
-    full_text = narrative.get("full_narrative", "").lower()
+    raw_text = narrative.get("full_narrative", "")
+    full_text = raw_text.lower()  # for substring checks; regexes are case-insensitive
     checks = []
+    keywords = scan_keywords(full_text)
     
     # 1. Critical Checks
     # a. WHO
@@ -25,15 +67,13 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     typology = narrative.get("title", "").lower()
     checks.append({
         "check": "WHAT_ACTIVITY_DESCRIBED",
-        "status": "PASS" if (alert_type in full_text or "structuring" in full_text or "layering" in full_text) else "FAIL",
+        "status": "PASS" if (alert_type in full_text or keywords["what"]) else "FAIL",
         "severity": "critical",
         "detail": "Activity type described."
     })
     
     # c. WHEN
-    # Regex for dates: YYYY-MM-DD, MM/DD/YYYY, or Month names
-    date_pattern = r"(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|january|february|march|april|may|june|july|august|september|october|november|december)"
-    has_dates = re.search(date_pattern, full_text)
+    has_dates = _DATE_RE.search(raw_text)
     checks.append({
         "check": "WHEN_DATES_PRESENT",
         "status": "PASS" if has_dates else "FAIL",
@@ -43,8 +83,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     
     # d. WHERE
     # Check for simple location indicators
-    loc_terms = ["branch", "state", "country", "jurisdiction", "bank", "location"]
-    has_loc = any(t in full_text for t in loc_terms)
+    has_loc = bool(keywords["loc"])
     checks.append({
         "check": "WHERE_LOCATION_PRESENT",
         "status": "PASS" if has_loc else "FAIL",
@@ -53,8 +92,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     })
     
     # e. WHY
-    suspicion_terms = ["suspicious", "inconsistent", "deviation", "unusual", "anomal", "red flag", "indicator", "appears"]
-    suspicion_count = sum(1 for t in suspicion_terms if t in full_text)
+    suspicion_count = len(keywords["susp"])
     checks.append({
         "check": "WHY_SUSPICION_EXPLAINED",
         "status": "PASS" if suspicion_count >= 2 else "FAIL",
@@ -64,8 +102,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     
     # 2. Major Checks
     # f. HOW
-    mech_terms = ["deposit", "withdraw", "wire", "transfer", "cash", "fund", "transaction"]
-    mech_count = sum(1 for t in mech_terms if t in full_text)
+    mech_count = len(keywords["mech"])
     checks.append({
         "check": "HOW_MECHANISM_DESCRIBED",
         "status": "PASS" if mech_count >= 3 else "FAIL",
@@ -74,9 +111,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     })
     
     # g. AMOUNTS
-    # $X, USD X, or strict numbers
-    amount_pattern = r"(\$|usd|eur)\s?\d{1,3}(,\d{3})*(\.\d{2})?"
-    amount_matches = len(re.findall(amount_pattern, full_text))
+    amount_matches = sum(1 for _ in _AMOUNT_RE.finditer(raw_text))
     checks.append({
         "check": "AMOUNTS_SPECIFIC",
         "status": "PASS" if amount_matches >= 2 else "WARN",
@@ -85,8 +120,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     })
     
     # h. COUNTS
-    count_pattern = r"\d+\s(transactions|deposits|withdrawals|wires|transfers)"
-    count_matches = len(re.findall(count_pattern, full_text))
+    count_matches = sum(1 for _ in _COUNT_RE.finditer(raw_text))
     checks.append({
         "check": "TRANSACTION_COUNTS",
         "status": "PASS" if count_matches > 0 else "WARN",
@@ -98,7 +132,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     # i. PRIOR HISTORY
     prior_sars = case_input.get("risk_intelligence", {}).get("prior_sars", [])
     if prior_sars:
-        has_ref = any(t in full_text for t in ["prior", "previous", "filing", "continuing", "dcn"])
+        has_ref = bool(keywords["prior"])
         checks.append({
             "check": "PRIOR_HISTORY_REFERENCED",
             "status": "PASS" if has_ref else "WARN",
@@ -119,8 +153,7 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     })
     
     # k. DEFINITIVE CONCLUSIONS
-    def_terms = ["is guilty", "committed money laundering", "is laundering money", "illegal activity confirmed"]
-    has_def = any(t in full_text for t in def_terms)
+    has_def = bool(keywords["def"])
     checks.append({
         "check": "NO_DEFINITIVE_CONCLUSIONS",
         "status": "FAIL" if has_def else "PASS", # Actually FAIL or WARN? Plan said WARN but logically FAIL. Let's stick to WARN to be safe for proto.
@@ -129,13 +162,21 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
     })
 
     # Consolidate
-    passed = sum(1 for c in checks if c["status"] == "PASS")
-    warnings = sum(1 for c in checks if c["status"] == "WARN")
-    failed = sum(1 for c in checks if c["status"] == "FAIL")
-    
-    # Overall Status
-    crit_fail = any(c["status"] == "FAIL" and c["severity"] == "critical" for c in checks)
-    maj_fail = any(c["status"] == "FAIL" and c["severity"] == "major" for c in checks) # actually plan said 'Fail' status only for critical?
+    passed = warnings = failed = 0
+    crit_fail = maj_fail = False
+    for c in checks:
+        status = c["status"]
+        if status == "PASS":
+            passed += 1
+        elif status == "WARN":
+            warnings += 1
+        elif status == "FAIL":
+            failed += 1
+            # Overall Status
+            if c["severity"] == "critical":
+                crit_fail = True
+            elif c["severity"] == "major": # actually plan said 'Fail' status only for critical?
+                maj_fail = True
     # Reread plan: "WARN if any major check failed" -> so major check returning FAIL is Status WARN for overall.
     # Actually my code above sets status to FAIL for major check if criteria not met.
     # Let's align:
@@ -160,6 +201,24 @@ def validate_5w_how(narrative: Dict, case_input: Dict, dossier: Dict) -> Dict:
         "validation_timestamp": datetime.datetime.utcnow().isoformat()
     }
 
+# Fields shared by every sentence trace; evidence pointers are still a placeholder,
+# so all traces reference one immutable empty tuple instead of a fresh list each
+_TRACE_NO_EVIDENCE = ()
+_TRACE_SOURCE_SUMMARY = "Derived from enriched dossier"
+
+def iter_sentences(text: str):
+    """
+    Lazily yield the stripped ". "-separated sentences of text.
+    """
+    start = 0
+    while True:
+        end = text.find(". ", start)
+        if end == -1:
+            yield text[start:].strip()
+            return
+        yield text[start:end].strip()
+        start = end + 2
+
 def compile_audit_package(state: Dict) -> Dict:
     """
     Compile full audit trail.
@@ -173,16 +232,16 @@ def compile_audit_package(state: Dict) -> Dict:
     
     # Traceability
     full_text = narrative.get("full_narrative", "") if narrative else ""
-    sentences = full_text.split(". ")
-    traces = []
-    for s in sentences:
-        if len(s.strip()) > 10:
-            traces.append({
-                "sentence": s.strip(),
-                "evidence_pointers": [], # Placeholder
-                "source_data_summary": "Derived from enriched dossier",
-                "typology_basis": typology.get("primary_typology") if typology else "None"
-            })
+    typology_basis = typology.get("primary_typology") if typology else "None"
+    traces = [
+        {
+            "sentence": s,
+            "evidence_pointers": _TRACE_NO_EVIDENCE, # Placeholder
+            "source_data_summary": _TRACE_SOURCE_SUMMARY,
+            "typology_basis": typology_basis
+        }
+        for s in iter_sentences(full_text) if len(s) > 10
+    ]
             
     # Audit Logs
     ingest = {
@@ -213,7 +272,7 @@ def compile_audit_package(state: Dict) -> Dict:
     
     return {
         "case_id": case.get("alert", {}).get("alert_id"),
-        "pipeline_version": "STRATIFY v0.1",
+        "pipeline_version": PIPELINE_VERSION,
         "generated_at": datetime.datetime.utcnow().isoformat(),
         "traceability": traces,
         "audit_logs": {
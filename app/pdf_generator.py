@@ -1,42 +1,58 @@
 from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 import json
 import textwrap
+from typing import Optional
+
+# Fixed font styles, built once (Arial is a core font, so nothing is loaded from disk)
+HEADER_FONT = ('Arial', 'B', 15)
+FOOTER_FONT = ('Arial', 'I', 8)
+TITLE_FONT = ('Arial', 'B', 12)
+BODY_FONT = ('Arial', '', 11)
+LABEL_FONT = ('Arial', 'B', 11)
+TABLE_HEADER_FONT = ('Arial', 'B', 10)
+TABLE_FONT = ('Arial', '', 10)
+TITLE_FILL = (200, 220, 255)
+STATUS_COLORS = {"PASS": (0, 128, 0), "WARN": (255, 165, 0)}
+FAIL_COLOR = (255, 0, 0)
 
 class SARPDF(FPDF):
     def header(self):
-        self.set_font('Arial', 'B', 15)
+        self.set_font(*HEADER_FONT)
         self.cell(0, 10, 'Suspicious Activity Report (SAR) - STRATIFY', 0, 1, 'C')
         self.ln(5)
 
     def footer(self):
         self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
+        self.set_font(*FOOTER_FONT)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
         self.cell(0, 10, 'CONFIDENTIAL - FOR OFFICIAL USE ONLY', 0, 0, 'R')
 
     def chapter_title(self, label):
-        self.set_font('Arial', 'B', 12)
-        self.set_fill_color(200, 220, 255)
+        self.set_font(*TITLE_FONT)
+        self.set_fill_color(*TITLE_FILL)
         self.cell(0, 6, label, 0, 1, 'L', 1)
         self.ln(4)
 
     def chapter_body(self, text):
-        self.set_font('Arial', '', 11)
-        self.multi_cell(0, 5, text)
+        self.set_font(*BODY_FONT)
+        self.multi_cell(0, 5, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln()
 
     def key_value_pair(self, key, value):
-        self.set_font('Arial', 'B', 11)
+        self.set_font(*LABEL_FONT)
         self.cell(50, 6, f"{key}:", 0, 0)
-        self.set_font('Arial', '', 11)
-        self.multi_cell(0, 6, str(value))
+        self.set_font(*BODY_FONT)
+        self.multi_cell(0, 6, str(value), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
-def create_sar_pdf(state: dict) -> bytes:
+def create_sar_pdf(state: dict, output=None) -> Optional[bytes]:
     """
     Generates a PDF SAR report from the pipeline state.
-    Returns the PDF as bytes.
+    Returns the PDF as bytes, or writes it to `output` (any writable binary
+    stream, e.g. io.BytesIO or a file) and returns None.
     """
     pdf = SARPDF()
+    pdf.set_compression(True)
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
 
@@ -81,28 +97,26 @@ def create_sar_pdf(state: dict) -> bytes:
     val_results = state.get("validation_result", {})
     checks = val_results.get("checks", [])
     
-    pdf.set_font('Arial', 'B', 10)
+    pdf.set_font(*TABLE_HEADER_FONT)
     # Simple table header
     pdf.cell(140, 6, "Check Description", 1)
     pdf.cell(30, 6, "Status", 1)
     pdf.ln()
     
-    pdf.set_font('Arial', '', 10)
+    pdf.set_font(*TABLE_FONT)
+    current_color = None
     for check in checks:
         status = check.get("status", "FAIL")
         name = check.get("name", "Check")
         
-        # Color code status
-        if status == "PASS":
-            pdf.set_text_color(0, 128, 0)
-        elif status == "WARN":
-            pdf.set_text_color(255, 165, 0)
-        else:
-            pdf.set_text_color(255, 0, 0)
+        # Color code status, switching only when it changes between rows
+        color = STATUS_COLORS.get(status, FAIL_COLOR)
+        if color != current_color:
+            pdf.set_text_color(*color)
+            current_color = color
             
         pdf.cell(140, 6, name, 1)
-        pdf.cell(30, 6, status, 1)
-        pdf.ln()
+        pdf.cell(30, 6, status, 1, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     
     pdf.set_text_color(0, 0, 0) # Reset color
     pdf.ln(5)
@@ -118,14 +132,19 @@ def create_sar_pdf(state: dict) -> bytes:
     pdf.ln(2)
     
     # Add risk factors from Triage
-    pdf.set_font('Arial', 'B', 11)
+    pdf.set_font(*LABEL_FONT)
     pdf.cell(0, 6, "Risk Factors Identified:", 0, 1)
-    pdf.set_font('Arial', '', 10)
+    pdf.set_font(*TABLE_FONT)
     
     factors = triage.get("decision_factors", [])
     for factor in factors:
         factor_text = f"- {factor.get('factor')} ({factor.get('direction')})"
         pdf.cell(0, 5, factor_text, 0, 1)
 
-    # Return PDF as bytes
-    return pdf.output(dest='S').encode('latin-1')
+    if output is not None:
+        # Write fpdf2's buffer straight to the stream, skipping the bytes copy
+        pdf.output(output)
+        return None
+
+    # Return PDF as bytes (fpdf2 already produces a bytearray)
+    return bytes(pdf.output())
@@ -1,14 +1,73 @@
 import streamlit as st
+import hashlib
+import html
 import json
 import os
 import sys
 import time
+import traceback
+from pathlib import Path
 
 # Add project root to path to allow imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from pipeline.graph import run_pipeline
-from app.pdf_generator import create_sar_pdf
+from agents.node3_generate import LLM_MODEL
+from agents.node4_validate_package import PIPELINE_VERSION
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+def fast_json(obj):
+    """
+    Pre-serialize obj with orjson so st.json skips its own json.dumps pass.
+    Falls back to the object itself when orjson is unavailable.
+    """
+    if not HAS_ORJSON:
+        return obj
+    return orjson.dumps(obj, default=repr, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def metric_cards(metrics: list, columns: int = 1) -> str:
+    """
+    Render (label, value[, delta]) metrics as one HTML block of cards,
+    so a cluster of metrics is sent as a single element instead of one per st.metric.
+    """
+    cards = []
+    for label, value, *delta in metrics:
+        card = (
+            f'<div class="metric-card"><div class="metric-label">{html.escape(str(label))}</div>'
+            f'<div class="metric-value">{html.escape(str(value))}</div>'
+        )
+        if delta:
+            card += f'<div class="metric-delta">{html.escape(str(delta[0]))}</div>'
+        cards.append(card + "</div>")
+    return f'<div class="metric-grid" style="grid-template-columns: repeat({columns}, 1fr);">{"".join(cards)}</div>'
+
+# st.cache_data rather than lru_cache: the script (and any lru_cache) is re-created on every rerun
+@st.cache_data(show_spinner=False, max_entries=64)
+def overview_html(classification, confidence, risk_score, processing_time, expected, typology) -> str:
+    """
+    Overview header (two columns of metric cards) as one cached HTML snippet.
+    """
+    is_match = classification == expected
+    match_icon = "✅" if is_match else "❌"
+
+    col2_metrics = [
+        ("Expected Result", expected),
+        ("Match", f"{match_icon} {'Correct' if is_match else 'Mismatch'}"),
+    ]
+    if typology:
+        col2_metrics.append(("Identified Typology", typology))
+
+    col1 = metric_cards([
+        ("Triage Result", classification, f"{confidence} Confidence"),
+        ("Risk Score", f"{risk_score or 0:.2f}/100"),
+        ("Processing Time", f"{processing_time}s"),
+    ])
+    return f'<div class="metric-grid" style="grid-template-columns: repeat(2, 1fr);">{col1}{metric_cards(col2_metrics)}</div>'
 
 # Page Config
 st.set_page_config(
@@ -32,12 +91,29 @@ st.markdown("""
     h2 {
         color: #1c4e80;
     }
-    .stMetric {
+    .stMetric, .metric-card {
         background-color: #ffffff;
         padding: 10px;
         border-radius: 5px;
         box-shadow: 0 1px 3px rgba(0,0,0,0.12);
     }
+    .metric-grid {
+        display: grid;
+        gap: 1rem;
+        margin-bottom: 1rem;
+    }
+    .metric-label {
+        font-size: 0.875rem;
+        color: #555;
+    }
+    .metric-value {
+        font-size: 1.75rem;
+        line-height: 1.3;
+    }
+    .metric-delta {
+        font-size: 0.875rem;
+        color: #555;
+    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -56,9 +132,19 @@ scenarios = [
     "Scenario 4: Seasonal Business Spike (FALSE_POSITIVE)",
     "Scenario 5: Continuing Activity - Prior SAR (TRUE_POSITIVE)"
 ]
+SCENARIO_MAP = {label: i + 1 for i, label in enumerate(scenarios)}
+
+# Validation status -> icon
+STATUS_ICONS = {"PASS": "✅", "WARN": "⚠️", "FAIL": "❌"}
+
+# Draft narrative fields shown in the Raw Data tab (everything but the full text)
+NARRATIVE_META_KEYS = (
+    "case_id", "title", "filing_type", "sections", "word_count", "generation_model",
+    "generation_timestamp", "prompt_hash", "rag_chunks_used"
+)
 
 selected_scenario = st.sidebar.selectbox("Select Demo Scenario", scenarios)
-scenario_num = int(selected_scenario.split(":")[0].split(" ")[1])
+scenario_num = SCENARIO_MAP[selected_scenario]
 
 # Run Button
 if st.sidebar.button("Run Pipeline", type="primary"):
@@ -79,6 +165,83 @@ st.sidebar.info("""
 # 2. Main Logic
 # -----------------
 
+@st.cache_data(show_spinner=False)
+def load_scenario(scenario_num: int) -> dict:
+    """
+    Load and parse a demo scenario once; reruns get a cached copy.
+    """
+    path = f"data/scenarios/scenario_{scenario_num}.json"
+    if HAS_ORJSON:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+# On-disk copy of pipeline results, so warm restarts skip the pipeline too
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PIPELINE_CACHE_DIR = PROJECT_ROOT / ".stratify_cache"
+PIPELINE_CACHE_TTL_SECONDS = 3600
+PIPELINE_SOURCE_DIRS = ("agents", "pipeline", "rag")
+
+@st.cache_resource(show_spinner=False)
+def pipeline_code_fingerprint() -> str:
+    """
+    Hash of the pipeline's Python sources, so an upgrade never serves
+    results cached by the previous code, even if PIPELINE_VERSION was not bumped.
+    """
+    h = hashlib.sha256()
+    for source_dir in PIPELINE_SOURCE_DIRS:
+        for path in sorted((PROJECT_ROOT / source_dir).glob("*.py")):
+            h.update(path.name.encode())
+            h.update(path.read_bytes())
+    return h.hexdigest()[:16]
+
+@st.cache_data(show_spinner=False, ttl=PIPELINE_CACHE_TTL_SECONDS)
+def run_pipeline_cached(scenario_num: int) -> dict:
+    """
+    Run the pipeline for a scenario; repeat runs within the TTL reuse the result,
+    from memory or, after a restart, from the on-disk cache.
+    """
+    case_input = load_scenario(scenario_num)
+    # Key on the scenario contents and on everything that changes the output
+    # (pipeline code and version, model, LLM vs template narrative), so no stale entry is hit
+    api_key = os.environ.get("OPENAI_API_KEY", "")
+    has_llm_key = bool(api_key) and not api_key.startswith("sk-your-key")
+    cache_key = json.dumps(
+        [case_input, PIPELINE_VERSION, pipeline_code_fingerprint(), LLM_MODEL, has_llm_key],
+        sort_keys=True,
+    )
+    digest = hashlib.sha256(cache_key.encode()).hexdigest()[:16]
+    cache_file = PIPELINE_CACHE_DIR / f"scenario_{scenario_num}_{digest}.json"
+    
+    # JSON rather than pickle, so a tampered cache file can never execute code on load
+    try:
+        if time.time() - cache_file.stat().st_mtime < PIPELINE_CACHE_TTL_SECONDS:
+            return json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        pass
+    
+    final_state = run_pipeline(case_input)
+    
+    try:
+        PIPELINE_CACHE_DIR.mkdir(exist_ok=True)
+        tmp_file = cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(final_state))
+        os.replace(tmp_file, cache_file)  # atomic, so readers never see a partial file
+    except (OSError, TypeError) as e:
+        print(f"[App] Could not write pipeline cache: {e}")
+    return final_state
+
+@st.cache_data(show_spinner=False)
+def build_pdf(alert_id: str, generated_at: str, _state: dict) -> bytes:
+    """
+    Render the SAR PDF once per pipeline run instead of on every rerun.
+    The state itself is not hashed; alert_id + audit timestamp identify the run.
+    """
+    # Imported lazily: fpdf is only needed once a TRUE_POSITIVE report is shown
+    from app.pdf_generator import create_sar_pdf
+    return create_sar_pdf(_state)
+
 if "run_triggered" not in st.session_state:
     st.session_state["run_triggered"] = False
     st.session_state["pipeline_result"] = None
@@ -86,18 +249,17 @@ if "run_triggered" not in st.session_state:
 if st.session_state["run_triggered"]:
     # Reset trigger to prevent re-runs on interaction
     st.session_state["run_triggered"] = False
+    run_scenario_num = st.session_state['scenario_num']
+    run_scenario_name = st.session_state['scenario_name']
     
-    scenario_file = f"data/scenarios/scenario_{st.session_state['scenario_num']}.json"
-    
-    with st.spinner(f"Running STRATIFY pipeline on {st.session_state['scenario_name']}..."):
+    with st.spinner(f"Running STRATIFY pipeline on {run_scenario_name}..."):
         try:
             # Load Data
-            with open(scenario_file, "r") as f:
-                case_input = json.load(f)
+            case_input = load_scenario(run_scenario_num)
             
             # Execute Pipeline
             start_time = time.time()
-            final_state = run_pipeline(case_input)
+            final_state = run_pipeline_cached(run_scenario_num)
             end_time = time.time()
             
             # Store Result in Session State
@@ -111,12 +273,192 @@ if st.session_state["run_triggered"]:
             
         except Exception as e:
             st.error(f"Pipeline Execution Failed: {str(e)}")
-            st.code(str(e)) # Show simplified first
+            with st.expander("Traceback"):
+                st.code(traceback.format_exc())
 
 # -----------------
 # 3. Display Results
 # -----------------
 
+# Each tab is a fragment so widget interactions inside it only rerun that tab
+@st.fragment
+def render_overview(res: dict, state: dict):
+    """
+    Overview tab: triage result, PDF download and decision factors.
+    """
+    # Triage Classification
+    triage_data = state.get("triage_decision", {})
+    classification = res.get("triage_decision")
+    confidence = triage_data.get("confidence", "High")
+
+    st.markdown(overview_html(
+        classification,
+        confidence,
+        res.get("risk_score", 0),
+        res.get("processing_time"),
+        res.get("expected_triage"),
+        res.get("typology")
+    ), unsafe_allow_html=True)
+
+    # --- PDF Download for True Positives ---
+    if classification == "TRUE_POSITIVE":
+        st.markdown("---")
+        alert_id = state['case_input']['alert']['alert_id']
+        pdf_bytes = build_pdf(
+            alert_id,
+            (state.get("audit_package") or {}).get("generated_at", ""),
+            state
+        )
+        st.download_button(
+            label="📄 Download SAR Report (PDF)",
+            data=pdf_bytes,
+            file_name=f"SAR_{alert_id}.pdf",
+            mime="application/pdf",
+            type="primary"
+        )
+        st.markdown("---")
+
+    st.subheader("Triage Explanation")
+    st.info(res.get("triage_explanation"))
+
+    # Decision Factors
+    if "decision_factors" in triage_data:
+        st.subheader("Decision Factors")
+        # One table element instead of an expander per factor
+        st.dataframe(
+            [
+                {
+                    "Factor": factor.get("factor"),
+                    "Direction": factor.get("direction"),
+                    "Weight": factor.get("weight"),
+                    "Evidence": factor.get("evidence"),
+                }
+                for factor in triage_data["decision_factors"]
+            ],
+            hide_index=True
+        )
+
+@st.fragment
+def render_narrative(res: dict, state: dict):
+    """
+    SAR Narrative tab.
+    """
+    narrative = res.get("sar_narrative")
+    if narrative:
+        st.subheader(narrative.get("title", "Suspicious Activity Report Narrative"))
+        st.caption(f"Filing Type: SAR | Model: {narrative.get('generation_model')}")
+
+        st.markdown("---")
+        # Render Markdown Narrative
+        st.markdown(narrative.get("full_narrative", ""))
+        st.markdown("---")
+
+        # Metrics
+        m1, m2 = st.columns(2)
+        m1.metric("Word Count", narrative.get("word_count"))
+        m2.metric("RAG Context Chunks", narrative.get("rag_chunks_used"))
+    else:
+        st.info(f"No SAR narrative generated. Case classified as {res.get('triage_decision')}.")
+
+@st.fragment
+def render_validation(res: dict, state: dict):
+    """
+    Validation tab: 5W+How check results.
+    """
+    val = res.get("validation_result")
+    if val:
+        # Stats Headers
+        st.markdown(metric_cards([
+            ("Overall Status", val['overall_status']),
+            ("Passed", val['passed']),
+            ("Warnings", val['warnings']),
+            ("Failed", val['failed']),
+        ], columns=4), unsafe_allow_html=True)
+
+        st.subheader("Validation Checks (5W+How)")
+
+        # One table element instead of an expander per check
+        st.dataframe(
+            [
+                {
+                    "Check": check['check'],
+                    "Status": f"{STATUS_ICONS.get(check['status'], '✅')} {check['status']}",
+                    "Severity": check['severity'].upper(),
+                    "Detail": check['detail'],
+                }
+                for check in val.get("checks", [])
+            ],
+            hide_index=True
+        )
+    else:
+        if res.get("triage_decision") == "TRUE_POSITIVE":
+            st.warning("Validation result missing.")
+        else:
+            st.info("Validation skipped (No Narrative).")
+
+@st.fragment
+def render_audit(res: dict, state: dict):
+    """
+    Audit Trail tab: agent logs and sentence traces.
+    """
+    audit = res.get("audit_package")
+    if audit:
+        st.caption(f"Pipeline Version: {audit.get('pipeline_version')} | Generated: {audit.get('generated_at')}")
+
+        # Agent Logs (serialized and sent only once the user asks for them)
+        logs = audit.get("audit_logs", {})
+
+        if st.toggle("Load agent logs", key="audit_load_logs"):
+            with st.expander("Node 1: Ingestion & Enrichment Logs"):
+                st.json(fast_json(logs.get("ingestion")))
+                st.json(fast_json(logs.get("enrichment")))
+
+            with st.expander("Node 2: Triage & Typology Logs"):
+                st.json(fast_json(logs.get("triage")))
+                st.json(fast_json(logs.get("typology")))
+
+            with st.expander("Node 3: Generation Logs"):
+                st.json(fast_json(logs.get("generation")))
+
+            with st.expander("Node 4: Validation Logs"):
+                st.json(fast_json(logs.get("validation")))
+
+        # Sentence Tracing
+        traces = audit.get("traceability", [])
+        if traces:
+            st.subheader(f"Sentence-Level Traceability ({len(traces)} traces)")
+            if st.toggle("Load first 5 traces", key="audit_load_traces"):
+                with st.expander("View First 5 Traces", expanded=True):
+                    st.json(fast_json(traces[:5]))
+    else:
+         st.info("No audit package generated.")
+
+@st.fragment
+def render_raw(res: dict, state: dict):
+    """
+    Raw Data tab: debugging view of the pipeline state.
+    """
+    st.warning("Debugging View")
+    # Large state dumps are only serialized once the user asks for them
+    if st.toggle("Load raw state", key="raw_load_state"):
+        with st.expander("Enriched Dossier"):
+            st.json(fast_json(state.get("enriched_dossier")))
+        with st.expander("Triage Decision"):
+            st.json(fast_json(state.get("triage_decision")))
+        if state.get("typology_assessment"):
+            with st.expander("Typology Assessment"):
+                st.json(fast_json(state.get("typology_assessment")))
+        if state.get("draft_narrative"):
+             with st.expander("Draft Narrative Metadata"):
+                 # exclude full text
+                 draft = state["draft_narrative"]
+                 meta = {k: draft[k] for k in NARRATIVE_META_KEYS if k in draft}
+                 st.json(fast_json(meta))
+
+    st.write("Full State Keys:")
+    st.write(list(state.keys()))
+
+
 if st.session_state.get("pipeline_result"):
     res = st.session_state["pipeline_result"]
     state = st.session_state["pipeline_state"]
@@ -130,160 +472,24 @@ if st.session_state.get("pipeline_result"):
     
     # --- TAB 1: OVERVIEW ---
     with tab1:
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            # Triage Classification
-            classification = res.get("triage_decision")
-            confidence = state.get("triage_decision", {}).get("confidence", "High")
-            
-            delta_color = "normal"
-            if classification == "TRUE_POSITIVE":
-                delta_color = "off" # Streamlit delta color logic is tricky, usually green for increase. 
-                # Let's just use normal metric
-            
-            st.metric("Triage Result", classification, delta=f"{confidence} Confidence", delta_color=delta_color)
-            st.metric("Risk Score", f"{res.get('risk_score', 0):.2f}/100")
-            st.metric("Processing Time", f"{res.get('processing_time')}s")
-            
-        with col2:
-            expected = res.get("expected_triage")
-            is_match = classification == expected
-            match_icon = "✅" if is_match else "❌"
-            
-            st.metric("Expected Result", expected)
-            st.metric("Match", f"{match_icon} {'Correct' if is_match else 'Mismatch'}")
-            
-            if res.get("typology"):
-                st.metric("Identified Typology", res.get("typology"))
-        
-        # --- PDF Download for True Positives ---
-        if classification == "TRUE_POSITIVE":
-            st.markdown("---")
-            pdf_bytes = create_sar_pdf(state)
-            st.download_button(
-                label="📄 Download SAR Report (PDF)",
-                data=pdf_bytes,
-                file_name=f"SAR_{state['case_input']['alert']['alert_id']}.pdf",
-                mime="application/pdf",
-                type="primary"
-            )
-            st.markdown("---")
-                
-        st.subheader("Triage Explanation")
-        st.info(res.get("triage_explanation"))
-        
-        # Decision Factors
-        triage_data = state.get("triage_decision", {})
-        if "decision_factors" in triage_data:
-            st.subheader("Decision Factors")
-            for factor in triage_data["decision_factors"]:
-                with st.expander(f"{factor.get('factor')} ({factor.get('direction')})"):
-                    st.write(f"**Weight:** {factor.get('weight')}")
-                    st.write(f"**Evidence:** {factor.get('evidence')}")
+        render_overview(res, state)
 
     # --- TAB 2: SAR NARRATIVE ---
     with tab2:
-        narrative = res.get("sar_narrative")
-        if narrative:
-            st.subheader(narrative.get("title", "Suspicious Activity Report Narrative"))
-            st.caption(f"Filing Type: SAR | Model: {narrative.get('generation_model')}")
-            
-            st.markdown("---")
-            # Render Markdown Narrative
-            st.markdown(narrative.get("full_narrative", ""))
-            st.markdown("---")
-            
-            # Metrics
-            m1, m2 = st.columns(2)
-            m1.metric("Word Count", narrative.get("word_count"))
-            m2.metric("RAG Context Chunks", narrative.get("rag_chunks_used"))
-        else:
-            st.info(f"No SAR narrative generated. Case classified as {res.get('triage_decision')}.")
+        render_narrative(res, state)
 
     # --- TAB 3: VALIDATION ---
     with tab3:
-        val = res.get("validation_result")
-        if val:
-            # Stats Headers
-            s1, s2, s3, s4 = st.columns(4)
-            
-            status_color = "off"
-            if val['overall_status'] == "PASS": status_color = "normal"
-            elif val['overall_status'] == "FAIL": status_color = "inverse"
-            
-            s1.metric("Overall Status", val['overall_status'])
-            s2.metric("Passed", val['passed'])
-            s3.metric("Warnings", val['warnings'])
-            s4.metric("Failed", val['failed'])
-            
-            st.subheader("Validation Checks (5W+How)")
-            
-            for check in val.get("checks", []):
-                icon = "✅"
-                if check['status'] == "WARN": icon = "⚠️"
-                if check['status'] == "FAIL": icon = "❌"
-                
-                with st.expander(f"{icon} {check['check']} ({check['severity'].upper()})"):
-                    st.write(f"**Status:** {check['status']}")
-                    st.write(f"**Detail:** {check['detail']}")
-        else:
-            if res.get("triage_decision") == "TRUE_POSITIVE":
-                st.warning("Validation result missing.")
-            else:
-                st.info("Validation skipped (No Narrative).")
+        render_validation(res, state)
 
     # --- TAB 4: AUDIT TRAIL ---
     with tab4:
-        audit = res.get("audit_package")
-        if audit:
-            st.caption(f"Pipeline Version: {audit.get('pipeline_version')} | Generated: {audit.get('generated_at')}")
-            
-            # Agent Logs
-            logs = audit.get("audit_logs", {})
-            
-            with st.expander("Node 1: Ingestion & Enrichment Logs"):
-                st.json(logs.get("ingestion"))
-                st.json(logs.get("enrichment"))
-                
-            with st.expander("Node 2: Triage & Typology Logs"):
-                st.json(logs.get("triage"))
-                st.json(logs.get("typology"))
-                
-            with st.expander("Node 3: Generation Logs"):
-                st.json(logs.get("generation"))
-                
-            with st.expander("Node 4: Validation Logs"):
-                st.json(logs.get("validation"))
-            
-            # Sentence Tracing
-            traces = audit.get("traceability", [])
-            if traces:
-                st.subheader(f"Sentence-Level Traceability ({len(traces)} traces)")
-                with st.expander("View First 5 Traces"):
-                    st.json(traces[:5])
-        else:
-             st.info("No audit package generated.")
+        render_audit(res, state)
 
     # --- TAB 5: RAW DATA ---
     with tab5:
-        st.warning("Debugging View")
-        with st.expander("Enriched Dossier"):
-            st.json(state.get("enriched_dossier"))
-        with st.expander("Triage Decision"):
-            st.json(state.get("triage_decision"))
-        if state.get("typology_assessment"):
-            with st.expander("Typology Assessment"):
-                st.json(state.get("typology_assessment"))
-        if state.get("draft_narrative"):
-             with st.expander("Draft Narrative Metadata"):
-                 # exclude full text
-                 meta = {k:v for k,v in state["draft_narrative"].items() if k != "full_narrative"}
-                 st.json(meta)
-        
-        st.write("Full State Keys:")
-        st.write(list(state.keys()))
+        render_raw(res, state)
 
 # Footer
 st.divider()
-st.caption("STRATIFY v0.1 | Powered by LangGraph & Google Gemini (Antigravity)")
+st.caption(f"{PIPELINE_VERSION} | Powered by LangGraph & Google Gemini (Antigravity)")
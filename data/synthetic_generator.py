@@ -1,7 +1,14 @@
 import json
 import random
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
+from operator import itemgetter
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # Set seed for reproducibility
 random.seed(42)
@@ -86,17 +93,20 @@ def generate_scenario_1():
     start_date = datetime(2025, 7, 1)
     end_date = datetime(2025, 12, 31)
     
-    known_counterparties = ["Mehta Traders", "Patel Exports", "Singh Fabrics", "Gupta Imports"]
+    known_counterparties = ("Mehta Traders", "Patel Exports", "Singh Fabrics", "Gupta Imports")
     
     current_date = start_date
     while current_date <= end_date:
+        # Every baseline month has at least 29 days, so offsets 0-28 stay in-month
+        month_prefix = f"{current_date.year}-{current_date.month:02d}-"
+
         # 8-12 inbound 
         num_inbound = random.randint(8, 12)
         for _ in range(num_inbound):
             amt = random.randint(30000, 150000)
             cp = random.choice(known_counterparties)
             day_offset = random.randint(0, 28) # simpler logic, just spread in month
-            txn_date = (current_date.replace(day=1) + timedelta(days=day_offset)).isoformat().split('T')[0]
+            txn_date = f"{month_prefix}{day_offset + 1:02d}"
             
             transactions.append(_txn(
                 txn_id=f"TXN-{txn_counter:04d}",
@@ -116,7 +126,7 @@ def generate_scenario_1():
         for _ in range(num_outbound):
             amt = random.randint(20000, 80000)
             day_offset = random.randint(0, 28)
-            txn_date = (current_date.replace(day=1) + timedelta(days=day_offset)).isoformat().split('T')[0]
+            txn_date = f"{month_prefix}{day_offset + 1:02d}"
             
             transactions.append(_txn(
                 txn_id=f"TXN-{txn_counter:04d}",
@@ -138,7 +148,7 @@ def generate_scenario_1():
     # Suspicious Period: Jan 3-10, 2026
     # 47 cash deposits
     suspicious_txns_ids = []
-    branches = ["BR-PUNE-042", "BR-PUNE-017", "BR-MUM-003", "BR-DEL-011"]
+    branches = ("BR-PUNE-042", "BR-PUNE-017", "BR-MUM-003", "BR-DEL-011")
     
     for i in range(1, 48):
         amt = random.randint(80000, 130000)
@@ -181,7 +191,7 @@ def generate_scenario_1():
     suspicious_txns_ids.append(wire_txn["txn_id"])
     txn_counter += 1
 
-    transactions.sort(key=lambda x: x['date'])
+    transactions.sort(key=itemgetter('date'))
 
     # Alert
     alert = {
@@ -245,6 +255,7 @@ def generate_scenario_2():
     
     transactions = []
     txn_counter = 1
+    expense_memos = ("Rent", "Groceries", "Amazon", "SIP")
     
     # Baseline: Jul-Dec 2025
     months = [("2025-07-31", "July Salary"), ("2025-08-31", "August Salary"), 
@@ -252,6 +263,8 @@ def generate_scenario_2():
               ("2025-11-30", "November Salary"), ("2025-12-31", "December Salary")]
     
     for date_str, desc in months:
+        month_prefix = date_str[:8]  # "YYYY-MM-"
+
         # Salary
         transactions.append(_txn(
             txn_id=f"TXN-{txn_counter:04d}",
@@ -271,16 +284,15 @@ def generate_scenario_2():
         for _ in range(num_exp):
             amt = random.randint(5000, 40000)
             # Random date within month
-            dt = datetime.strptime(date_str, "%Y-%m-%d")
             day = random.randint(1, 28)
-            txn_date = dt.replace(day=day).strftime("%Y-%m-%d")
+            txn_date = f"{month_prefix}{day:02d}"
             
             transactions.append(_txn(
                 txn_id=f"TXN-{txn_counter:04d}",
                 date=txn_date,
                 amount=amt,
                 type="pos_purchase",
-                memo=random.choice(["Rent", "Groceries", "Amazon", "SIP"]),
+                memo=random.choice(expense_memos),
                 channel="pos",
                 direction="outbound"
             ))
@@ -315,7 +327,7 @@ def generate_scenario_2():
     transactions.append(flagged_txn)
     txn_counter += 1
     
-    transactions.sort(key=lambda x: x['date'])
+    transactions.sort(key=itemgetter('date'))
     
     alert = {
         "alert_id": "ALT-2026-00601",
@@ -432,7 +444,7 @@ def generate_scenario_3():
         txn_counter += 1
         
     # 6 Withdrawals
-    atms = ["ATM-DEL-101", "ATM-DEL-205", "ATM-NOI-033"]
+    atms = ("ATM-DEL-101", "ATM-DEL-205", "ATM-NOI-033")
     for i in range(6):
         amt = random.randint(80000, 140000)
         day = random.randint(6, 16)
@@ -452,7 +464,7 @@ def generate_scenario_3():
         suspicious_ids.append(t["txn_id"])
         txn_counter += 1
         
-    transactions.sort(key=lambda x: x['date'])
+    transactions.sort(key=itemgetter('date'))
     
     alert = {
         "alert_id": "ALT-2026-00712",
@@ -576,7 +588,7 @@ def generate_scenario_4():
     diwali_2025_txns.extend(gen_month(2025, 11, is_diwali=True))
     transactions.extend(diwali_2025_txns)
     
-    transactions.sort(key=lambda x: x['date'])
+    transactions.sort(key=itemgetter('date'))
     
     # Flag all 2025 Diwali deposits
     flagged_ids = [t['txn_id'] for t in diwali_2025_txns if t['type'] == 'cash_deposit']
@@ -656,7 +668,7 @@ def generate_scenario_5():
     txn_counter = 1
     
     # Baseline: Jul-Dec 2025
-    clients = ["Client A", "Client B", "Client C"]
+    clients = ("Client A", "Client B", "Client C")
     for m in range(7, 13):
         num_deps = random.randint(5, 8)
         for _ in range(num_deps):
@@ -678,7 +690,7 @@ def generate_scenario_5():
             
     # Suspicious: Jan 2026
     suspicious_ids = []
-    branches = ["BR-HYD-012", "BR-HYD-045", "BR-SEC-003"]
+    branches = ("BR-HYD-012", "BR-HYD-045", "BR-SEC-003")
     
     # 22 Cash deposits
     for i in range(1, 23):
@@ -719,7 +731,7 @@ def generate_scenario_5():
     suspicious_ids.append(wire_t["txn_id"])
     txn_counter += 1
     
-    transactions.sort(key=lambda x: x['date'])
+    transactions.sort(key=itemgetter('date'))
 
     alert = {
         "alert_id": "ALT-2026-00891",
@@ -762,8 +774,13 @@ def generate_all_scenarios():
     
     for i, scenario in enumerate(generators, 1):
         filename = f"{output_dir}/scenario_{i}.json"
-        with open(filename, 'w') as f:
-            json.dump(scenario, f, indent=2, default=str)
+        if HAS_ORJSON:
+            # Same layout as json.dump(indent=2); scenario text is ASCII-only
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(scenario, default=str, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filename, 'w') as f:
+                json.dump(scenario, f, indent=2, default=str)
         print(f"Generated {filename}")
 
 if __name__ == "__main__":
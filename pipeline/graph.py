@@ -1,10 +1,19 @@
 import json
 import os
 import sys
+from functools import lru_cache
 from typing import Dict, Any, Literal
 
-# Add project root to path
-sys.path.append(os.getcwd())
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Add project root to path only when run as a script (python pipeline/graph.py);
+# package imports (the app, batch harnesses) already resolve `pipeline`/`agents`
+if not __package__:
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from langgraph.graph import StateGraph, END
 from pipeline.state import STRATIFYState
@@ -52,7 +61,8 @@ def package_fp_exit(state: STRATIFYState) -> STRATIFYState:
     
     print(f"[Exit] Case classified as {classification}. No SAR narrative required.")
     
-    return {**state, "final_output": final_output}
+    # Partial update; LangGraph merges it into the existing state
+    return {"final_output": final_output}
 
 def build_graph():
     """
@@ -90,26 +100,27 @@ def build_graph():
     
     return workflow.compile()
 
-def run_pipeline(case_input: Dict[str, Any]) -> Dict[str, Any]:
+# Blank state template (every field None, retry_count 0), copied per run
+_EMPTY_STATE: Dict[str, Any] = dict.fromkeys(STRATIFYState.__annotations__)
+_EMPTY_STATE["retry_count"] = 0
+
+@lru_cache(maxsize=1)
+def build_graph_cached():
+    """
+    Build and compile the StateGraph once per process.
+    The compiled graph holds no per-run state, so it is safe to share.
+    """
+    return build_graph()
+
+def run_pipeline(case_input: Dict[str, Any], app=None) -> Dict[str, Any]:
     """
     Run the full pipeline for a given case input.
+    Uses the process-wide compiled graph unless `app` is given.
     """
-    app = build_graph()
+    if app is None:
+        app = build_graph_cached()
     
-    initial_state: STRATIFYState = {
-        "case_input": case_input,
-        "enriched_dossier": None,
-        "triage_decision": None,
-        "evidence_package": None,
-        "typology_assessment": None,
-        "rag_context": None,
-        "draft_narrative": None,
-        "validation_result": None,
-        "audit_package": None,
-        "final_output": None,
-        "retry_count": 0,
-        "error": None
-    }
+    initial_state: STRATIFYState = {**_EMPTY_STATE, "case_input": case_input}
     
     print("\n=== Starting STRATIFY Pipeline ===")
     final_state = app.invoke(initial_state)
@@ -122,8 +133,12 @@ if __name__ == "__main__":
     scenario_path = "data/scenarios/scenario_1.json"
     if os.path.exists(scenario_path):
         print(f"Loading {scenario_path}...")
-        with open(scenario_path, "r") as f:
-            case_data = json.load(f)
+        if HAS_ORJSON:
+            with open(scenario_path, "rb") as f:
+                case_data = orjson.loads(f.read())
+        else:
+            with open(scenario_path, "r") as f:
+                case_data = json.load(f)
             
         result = run_pipeline(case_data)
         
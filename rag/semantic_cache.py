@@ -0,0 +1,182 @@
+"""
+STRATIFY - Semantic Query Cache
+Reuses vectorstore results for queries whose embeddings are near-duplicates
+of a query that has already been run (cosine similarity >= threshold).
+"""
+
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, List, Optional, Tuple
+
+# Lifetime of a cached result; node 3 reuses it for its own context cache
+SEMANTIC_CACHE_TTL_SECONDS = 3600.0
+
+
+def _normalize(vector: List[float]) -> Tuple[float, ...]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return tuple(vector)
+    return tuple(v / norm for v in vector)
+
+
+class SemanticQueryCache:
+    """
+    Cache of (namespace, query embedding, k) -> retrieved chunk texts.
+    The namespace identifies the vectorstore and embedding model (see
+    vectorstore_namespace), so results never cross indexes.
+    Lookups return the best live entry whose cosine similarity to the query
+    is at least `threshold`. Entries expire after `ttl_seconds`; oldest
+    entries are evicted past `max_entries`.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # (namespace, embedding, k, stored_at, results), oldest first
+        self._entries: List[Tuple[Hashable, Tuple[float, ...], int, float, List[str]]] = []
+        self._lock = threading.Lock()
+
+    def _drop_expired(self, now: float) -> None:
+        # Entries are appended in time order, so expired ones sit at the front
+        expired = 0
+        for entry in self._entries:
+            if now - entry[3] < self.ttl_seconds:
+                break
+            expired += 1
+        if expired:
+            del self._entries[:expired]
+
+    def lookup(self, query_embedding: List[float], k: int, namespace: Hashable = None) -> Optional[List[str]]:
+        q = _normalize(query_embedding)
+        best_sim = self.threshold
+        best = None
+        with self._lock:
+            self._drop_expired(time.monotonic())
+            for entry_ns, emb, entry_k, _, results in self._entries:
+                if entry_ns != namespace or entry_k != k or len(emb) != len(q):
+                    continue
+                sim = sum(a * b for a, b in zip(emb, q))
+                if sim >= best_sim:
+                    best_sim = sim
+                    best = results
+        return list(best) if best is not None else None
+
+    def add(self, query_embedding: List[float], k: int, results: List[str], namespace: Hashable = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            self._entries.append((namespace, _normalize(query_embedding), k, now, list(results)))
+            if len(self._entries) > self.max_entries:
+                del self._entries[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared process-wide cache used by retrieve_rag_context
+default_semantic_cache = SemanticQueryCache()
+
+
+def clear_semantic_cache() -> None:
+    """
+    Drop every entry in the shared cache (e.g. after the index is rebuilt).
+    """
+    default_semantic_cache.clear()
+
+
+_namespace_ids = itertools.count()
+
+
+def new_cache_namespace(kind: str) -> Tuple[str, int]:
+    """
+    Fresh namespace for a store whose contents have no stable on-disk identity.
+    """
+    return (kind, next(_namespace_ids))
+
+
+def vectorstore_namespace(vectorstore) -> Optional[Hashable]:
+    """
+    Cache namespace for a vectorstore: its `cache_namespace` (set by
+    get_vectorstore / the in-process stores) plus the embedding model identity.
+    Returns None for stores without one, which are then not cached.
+    """
+    store = getattr(vectorstore, "cache_namespace", None)
+    if store is None:
+        return None
+    embeddings = getattr(vectorstore, "embeddings", None)
+    base = getattr(embeddings, "base", embeddings)
+    return (store, type(base).__name__, getattr(base, "model", None), getattr(base, "dim", None))
+
+
+def _map_concurrently(fn: Callable, items: List) -> List:
+    """
+    Apply fn to each item on a thread pool, preserving order.
+    Searches are I/O-bound (remote embeddings / vector DB), so they overlap well.
+    """
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=len(items)) as pool:
+        return list(pool.map(fn, items))
+
+
+def query_vectorstore_semantic_batch(vectorstore, queries: List[str], k: int = 5, cache: Optional[SemanticQueryCache] = None) -> List[List[str]]:
+    """
+    Query the vectorstore for several queries through the semantic cache.
+    All queries are embedded in one embed_documents call; each embedding is
+    checked against the cache and reused for the search on a miss. Stores
+    without a cache namespace are searched without caching.
+    Returns one list of chunk texts per query, in order.
+    """
+    if cache is None:
+        cache = default_semantic_cache
+
+    embeddings = getattr(vectorstore, "embeddings", None)
+    if embeddings is None:
+        # No embedding function exposed; search directly (concurrently) without caching
+        found = _map_concurrently(lambda q: vectorstore.similarity_search(q, k=k), queries)
+        return [[d.page_content for d in docs] for docs in found]
+
+    namespace = vectorstore_namespace(vectorstore)
+    query_embeddings = embeddings.embed_documents(queries)
+    all_results: List[Optional[List[str]]] = []
+    misses = []
+    for i, (query, query_embedding) in enumerate(zip(queries, query_embeddings)):
+        cached = cache.lookup(query_embedding, k, namespace) if namespace is not None else None
+        if cached is not None:
+            print(f"[RAG] Semantic cache hit for query: '{query}'")
+        else:
+            misses.append(i)
+        all_results.append(cached)
+
+    batch_search = getattr(vectorstore, "similarity_search_by_vectors", None)
+    if batch_search is not None and misses:
+        # Score all remaining queries against the store in one matrix product
+        found = batch_search([query_embeddings[i] for i in misses], k=k)
+    else:
+        # Run the remaining searches concurrently
+        found = _map_concurrently(
+            lambda i: vectorstore.similarity_search_by_vector(query_embeddings[i], k=k),
+            misses
+        )
+    for i, docs in zip(misses, found):
+        print(f"Found {len(docs)} relevant chunks for query: '{queries[i]}'")
+        contents = [d.page_content for d in docs]
+        if namespace is not None:
+            cache.add(query_embeddings[i], k, contents, namespace)
+        all_results[i] = contents
+    return all_results
+
+
+def query_vectorstore_semantic(vectorstore, query: str, k: int = 5, cache: Optional[SemanticQueryCache] = None) -> List[str]:
+    """
+    Query the vectorstore through the semantic cache (single query).
+    """
+    return query_vectorstore_semantic_batch(vectorstore, [query], k=k, cache=cache)[0]
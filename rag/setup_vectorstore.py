@@ -1,18 +1,22 @@
+import hashlib
+import json
 import os
-import glob
-import math
-from typing import List, Any
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple, Union
+import numpy as np
 from dotenv import load_dotenv
 
 # Load env variables (API key)
 load_dotenv()
 
-from langchain_community.document_loaders import TextLoader
 from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 
+from rag.semantic_cache import clear_semantic_cache, new_cache_namespace
+
 # Optional: Try importing OpenAIEmbeddings
 try:
     from langchain_openai import OpenAIEmbeddings
@@ -20,77 +24,195 @@ try:
 except ImportError:
     HAS_OPENAI_LIB = False
 
+# "chroma" (persisted, default) or "memory" (exact in-process scan, see MatrixVectorStore)
+VECTOR_BACKEND = os.environ.get("STRATIFY_VECTOR_BACKEND", "chroma").lower()
+
+# Filename substring -> document_type, checked in order
+_DOCUMENT_TYPES = ("instructions", "errors", "typologies", "templates")
+
 def get_document_type(filename: str) -> str:
     base = os.path.basename(filename).lower()
-    if "instructions" in base: return "instructions"
-    if "errors" in base: return "errors"
-    if "typologies" in base: return "typologies"
-    if "templates" in base: return "templates"
-    return "general"
+    return next((t for t in _DOCUMENT_TYPES if t in base), "general")
 
 class SimpleEmbeddings(Embeddings):
     """
     Deterministic fallback embedding model based on character trigram hashing.
     Produces 384-dimensional vectors. Sufficient for prototyping without API keys.
+    Trigrams are hashed over the lowercased UTF-8 bytes with a fixed polynomial,
+    so vectors are stable across processes (unlike the salted built-in hash()).
     """
+    _HASH_P = 1000003
+
     def __init__(self, dim: int = 384):
         self.dim = dim
 
-    def _embed(self, text: str) -> List[float]:
-        vector = [0.0] * self.dim
-        text = text.lower()
-        if len(text) < 3:
-            return vector
-            
-        # Hash trigrams
-        for i in range(len(text) - 2):
-            trigram = text[i:i+3]
-            idx = hash(trigram) % self.dim
-            vector[idx] += 1.0
-            
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed all texts in one vectorized pass; returns a contiguous
+        (N, dim) float32 matrix of unit rows.
+        """
+        encoded = [t.lower().encode("utf-8") for t in texts]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+        buf = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        if len(buf) < 3:
+            return np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        # Trigram hash at every byte position of the concatenated buffer
+        p = np.uint64(self._HASH_P)
+        hashes = (buf[:-2] * p + buf[1:-1]) * p + buf[2:]
+
+        # Keep only trigrams that start and end inside the same text
+        doc_ids = np.repeat(np.arange(len(texts)), lengths)[:-2]
+        offsets = np.cumsum(lengths) - lengths
+        valid = np.arange(len(hashes)) + 2 < (offsets + lengths)[doc_ids]
+
+        flat = doc_ids[valid] * self.dim + (hashes[valid] % np.uint64(self.dim)).astype(np.int64)
+        counts = np.bincount(flat, minlength=len(texts) * self.dim)
+        out = counts.astype(np.float32).reshape(len(texts), self.dim)
+
         # Normalize (L2)
-        norm = math.sqrt(sum(v*v for v in vector))
-        if norm > 0:
-            vector = [v/norm for v in vector]
-            
-        return vector
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    def _embed(self, text: str) -> List[float]:
+        return self.embed_matrix([text])[0].tolist()
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self._embed(t) for t in texts]
+        if not texts:
+            return []
+        return self.embed_matrix(texts).tolist()
 
     def embed_query(self, text: str) -> List[float]:
         return self._embed(text)
 
+class CachedEmbeddings(Embeddings):
+    """
+    Exact-match LRU cache in front of another embedding model.
+    The pipeline re-issues the same RAG queries for every case of a typology,
+    so repeated texts skip re-embedding (a network round-trip for OpenAI).
+    """
+    def __init__(self, base: Embeddings, maxsize: int = 1024):
+        self.base = base
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+            return vector
+
+    def _put(self, key: Tuple[str, str], vector: List[float]) -> np.ndarray:
+        # Packed float32 rows instead of boxed Python floats: a full cache of
+        # 1536-d OpenAI vectors stays around 6 MB
+        array = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._cache[key] = array
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return array
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results: List[Any] = [self._get(("doc", t)) for t in texts]
+        missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+        if missing:
+            embedded = {
+                t: self._put(("doc", t), vector)
+                for t, vector in zip(missing, self.base.embed_documents(missing))
+            }
+            results = [r if r is not None else embedded[t] for t, r in zip(texts, results)]
+        return [r.tolist() for r in results]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get(("query", text))
+        if vector is None:
+            vector = self._put(("query", text), self.base.embed_query(text))
+        return vector.tolist()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
 def load_corpus(corpus_dir: str = "rag/corpus") -> List[Document]:
     """
     Load all .txt files from the corpus directory.
     """
     docs = []
-    files = glob.glob(os.path.join(corpus_dir, "*.txt"))
+    files = []
+    if os.path.isdir(corpus_dir):
+        with os.scandir(corpus_dir) as it:
+            files = sorted((e for e in it if e.name.endswith(".txt") and e.is_file()), key=lambda e: e.name)
     
     for f in files:
         try:
-            loader = TextLoader(f, encoding="utf-8")
-            loaded = loader.load()
-            
-            # Add custom metadata
-            doc_type = get_document_type(f)
-            for d in loaded:
-                d.metadata["source"] = os.path.basename(f)
-                d.metadata["document_type"] = doc_type
-                
-            docs.extend(loaded)
+            with open(f.path, encoding="utf-8") as fh:
+                content = fh.read()
+            docs.append(Document(
+                page_content=content,
+                metadata={"source": f.name, "document_type": get_document_type(f.name)}
+            ))
         except Exception as e:
-            print(f"Error loading {f}: {e}")
+            print(f"Error loading {f.path}: {e}")
             
     print(f"Loaded {len(files)} files from {corpus_dir}")
     return docs
 
-def create_vectorstore(documents: List[Document], persist_directory: str = "rag/chroma_db") -> Chroma:
+class MatrixVectorStore:
     """
-    Chunk documents and create Chroma vectorstore.
+    Exact inner-product search over an in-memory float32 matrix of unit vectors.
+    For a corpus of a few hundred chunks a brute-force scan is cheaper than
+    Chroma's client + HNSW round trip. Implements the subset of the Chroma
+    interface the pipeline uses (embeddings, similarity_search[_by_vector]).
+    """
+    def __init__(self, embedding: Embeddings, texts: List[str], metadatas: Optional[List[dict]] = None):
+        self.embeddings = embedding
+        self.texts = list(texts)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.texts]
+        base = embedding.base if isinstance(embedding, CachedEmbeddings) else embedding
+        if isinstance(base, SimpleEmbeddings):
+            # Build the matrix directly, skipping the List[List[float]] round trip
+            matrix = base.embed_matrix(self.texts)
+        else:
+            matrix = np.asarray(embedding.embed_documents(self.texts), dtype=np.float32)
+        self._matrix = _unit_rows(matrix.reshape(len(self.texts), -1))
+        self.cache_namespace = new_cache_namespace("memory")
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embedding: Embeddings) -> "MatrixVectorStore":
+        return cls(embedding, [d.page_content for d in documents], [d.metadata for d in documents])
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4) -> List[List[Document]]:
+        """
+        Top-k for a batch of query vectors with one (B, dim) x (dim, N) product.
+        """
+        queries = _unit_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        scores = queries @ self._matrix.T
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in embeddings]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return [[Document(page_content=self.texts[i], metadata=self.metadatas[i]) for i in row] for row in top]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vectors([embedding], k=k)[0]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """
+    Chunk documents for indexing.
     """
-    # 1. Split
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=800,
         chunk_overlap=100,
@@ -98,27 +220,130 @@ def create_vectorstore(documents: List[Document], persist_directory: str = "rag/
     )
     chunks = text_splitter.split_documents(documents)
     print(f"Created {len(chunks)} chunks from {len(documents)} documents")
-    
-    # 2. Embeddings
-    embedding_function = None
+    return chunks
+
+# Sidecar in persist_directory recording the corpus the store was built from
+FINGERPRINT_FILE = ".corpus_fingerprint.json"
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def corpus_fingerprint(corpus_dir: str = "rag/corpus") -> Dict[str, str]:
+    """
+    Content digest per corpus file ({filename: digest}), used to detect a stale vectorstore.
+    """
+    digests = {}
+    if os.path.isdir(corpus_dir):
+        with os.scandir(corpus_dir) as it:
+            for e in it:
+                if e.name.endswith(".txt") and e.is_file():
+                    with open(e.path, encoding="utf-8") as fh:
+                        digests[e.name] = _digest(fh.read())
+    return digests
+
+def _read_fingerprint(persist_directory: str) -> Optional[Dict[str, str]]:
+    try:
+        with open(os.path.join(persist_directory, FINGERPRINT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_fingerprint(persist_directory: str, fingerprint: Dict[str, str]) -> None:
+    path = os.path.join(persist_directory, FINGERPRINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(fingerprint, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+# Callbacks run after a re-index so downstream result caches drop stale chunks
+_reindex_listeners: List[Callable[[], None]] = [clear_semantic_cache]
+
+def add_reindex_listener(callback: Callable[[], None]) -> None:
+    """
+    Register a callback to run whenever sync_vectorstore re-indexes the corpus.
+    """
+    if callback not in _reindex_listeners:
+        _reindex_listeners.append(callback)
+
+def sync_vectorstore(vectorstore: Chroma, persist_directory: str, corpus_dir: str = "rag/corpus") -> None:
+    """
+    Re-index only the corpus files whose content changed since the store was built.
+    Stores without a fingerprint sidecar (built before it existed) are left as-is.
+    Registered re-index listeners run after any change.
+    """
+    stored = _read_fingerprint(persist_directory)
+    if stored is None:
+        return
+    current = corpus_fingerprint(corpus_dir)
+    if current == stored:
+        return
+
+    changed = [name for name, digest in current.items() if stored.get(name) != digest]
+    removed = [name for name in stored if name not in current]
+    print(f"[RAG] Corpus changed ({len(changed)} updated, {len(removed)} removed). Re-indexing affected files.")
+
+    for name in changed + removed:
+        vectorstore.delete(where={"source": name})
+    docs = [d for d in load_corpus(corpus_dir) if d.metadata["source"] in changed]
+    if docs:
+        vectorstore.add_documents(split_documents(docs))
+    _write_fingerprint(persist_directory, current)
+    for callback in _reindex_listeners:
+        callback()
+
+# Embedding model chosen for the current OPENAI_API_KEY value
+_embedding_function: Optional[CachedEmbeddings] = None
+_embedding_api_key: Optional[str] = None
+_embedding_lock = threading.Lock()
+
+def select_embedding_function() -> CachedEmbeddings:
+    """
+    OpenAI embeddings when a usable key is configured, else SimpleEmbeddings.
+    The choice (and OpenAI's connectivity probe) is made once per key value,
+    and the returned cached model is shared by every vectorstore. A failed probe
+    is not remembered, so the next call probes OpenAI again.
+    """
+    global _embedding_function, _embedding_api_key
     api_key = os.environ.get("OPENAI_API_KEY")
+    with _embedding_lock:
+        if _embedding_function is not None and api_key == _embedding_api_key:
+            return _embedding_function
 
-    if HAS_OPENAI_LIB and api_key and not api_key.startswith("sk-your-key"):
-        try:
-            embedding_function = OpenAIEmbeddings(model="text-embedding-3-small")
-            # Trigger a dummy embed to check connectivity
-            embedding_function.embed_query("test")
-            print("Using OpenAI Embeddings (text-embedding-3-small)")
-        except Exception as e:
+        if HAS_OPENAI_LIB and api_key and not api_key.startswith("sk-your-key"):
+            try:
+                embedding_function = OpenAIEmbeddings(model="text-embedding-3-small")
+                # Trigger a dummy embed to check connectivity
+                embedding_function.embed_query("test")
+                print("Using OpenAI Embeddings (text-embedding-3-small)")
+            except Exception as e:
+                print(f"Failed to init OpenAI Embeddings: {e}. Falling back to SimpleEmbeddings.")
+                return CachedEmbeddings(SimpleEmbeddings())
+        else:
             embedding_function = SimpleEmbeddings()
-            print(f"Failed to init OpenAI Embeddings: {e}. Falling back to SimpleEmbeddings.")
-    else:
-        embedding_function = SimpleEmbeddings()
-        if not HAS_OPENAI_LIB:
-            print("langchain_openai not found.")
-        elif not api_key:
-            print("No OPENAI_API_KEY found.")
-        print("Using Fallback SimpleEmbeddings (Deterministic Hashing)")
+            if not HAS_OPENAI_LIB:
+                print("langchain_openai not found.")
+            elif not api_key:
+                print("No OPENAI_API_KEY found.")
+            print("Using Fallback SimpleEmbeddings (Deterministic Hashing)")
+
+        _embedding_function = CachedEmbeddings(embedding_function)
+        _embedding_api_key = api_key
+        return _embedding_function
+
+def _chroma_namespace(persist_directory: str) -> Tuple[str, str]:
+    # Semantic-cache identity shared by every handle on the same persisted index
+    return ("chroma", os.path.abspath(persist_directory))
+
+def create_vectorstore(documents: List[Document], persist_directory: str = "rag/chroma_db", fingerprint: Optional[Dict[str, str]] = None) -> Chroma:
+    """
+    Chunk documents and create Chroma vectorstore.
+    Pass the corpus_fingerprint() of the corpus the documents were loaded from
+    to enable change detection on later loads; other documents get no sidecar.
+    """
+    # 1. Split
+    chunks = split_documents(documents)
+    
+    # 2. Embeddings
+    embedding_function = select_embedding_function()
 
     # 3. Create Vectorstore
     # Chroma handles persistence automatically if persist_directory is set
@@ -128,37 +353,61 @@ def create_vectorstore(documents: List[Document], persist_directory: str = "rag/
         persist_directory=persist_directory
     )
     
+    vectorstore.cache_namespace = _chroma_namespace(persist_directory)
+    if fingerprint is not None:
+        _write_fingerprint(persist_directory, fingerprint)
     print(f"Vectorstore created at {persist_directory}")
     return vectorstore
 
-def get_vectorstore(persist_directory: str = "rag/chroma_db", embedding_function=None) -> Chroma:
+# Persist directories already checked against the corpus by this process
+_synced_directories: Set[str] = set()
+_sync_lock = threading.Lock()
+
+# In-memory stores built this process, keyed by embedding model class
+_memory_stores: Dict[str, MatrixVectorStore] = {}
+_memory_stores_lock = threading.Lock()
+
+def get_vectorstore(persist_directory: str = "rag/chroma_db", embedding_function=None) -> Union[Chroma, MatrixVectorStore]:
     """
     Load existing vectorstore or create new one if empty.
+    With STRATIFY_VECTOR_BACKEND=memory, returns a process-wide MatrixVectorStore
+    over the corpus instead (persist_directory is ignored).
     """
     # Define embedding function to use for loading (must match creation)
     if embedding_function is None:
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if HAS_OPENAI_LIB and api_key and not api_key.startswith("sk-your-key"):
-            try:
-                embedding_function = OpenAIEmbeddings(model="text-embedding-3-small")
-                # Trigger a dummy embed to check connectivity
-                embedding_function.embed_query("test")
-                print("Using OpenAI Embeddings (text-embedding-3-small)")
-            except Exception as e:
-                embedding_function = SimpleEmbeddings()
-                print(f"Failed to init OpenAI Embeddings: {e}. Falling back to SimpleEmbeddings.")
-        else:
-            embedding_function = SimpleEmbeddings()
+        embedding_function = select_embedding_function()
+
+    if not isinstance(embedding_function, CachedEmbeddings):
+        embedding_function = CachedEmbeddings(embedding_function)
 
+    if VECTOR_BACKEND == "memory":
+        key = type(embedding_function.base).__name__
+        with _memory_stores_lock:
+            if key not in _memory_stores:
+                chunks = split_documents(load_corpus())
+                # Share the caller's cached model so query embeddings are cached once per process
+                _memory_stores[key] = MatrixVectorStore.from_documents(chunks, embedding_function)
+            return _memory_stores[key]
 
     if os.path.exists(persist_directory) and os.listdir(persist_directory):
         # Load existing
         # print(f"Loading existing vectorstore from {persist_directory}")
-        return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+        vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+        vectorstore.cache_namespace = _chroma_namespace(persist_directory)
+        # Check for corpus changes once per directory per process, not on every call
+        with _sync_lock:
+            if os.path.abspath(persist_directory) not in _synced_directories:
+                sync_vectorstore(vectorstore, persist_directory)
+                _synced_directories.add(os.path.abspath(persist_directory))
+        return vectorstore
     else:
         # Create new
+        fingerprint = corpus_fingerprint()
         docs = load_corpus()
-        return create_vectorstore(docs, persist_directory)
+        vectorstore = create_vectorstore(docs, persist_directory, fingerprint=fingerprint)
+        with _sync_lock:
+            _synced_directories.add(os.path.abspath(persist_directory))
+        return vectorstore
 
 def query_vectorstore(vectorstore, query: str, k: int = 5) -> List[str]:
     """
@@ -179,7 +428,7 @@ if __name__ == "__main__":
     
     docs = load_corpus()
     if docs:
-        vectorstore = create_vectorstore(docs)
+        vectorstore = create_vectorstore(docs, fingerprint=corpus_fingerprint())
         
         test_query = "How should I structure a SAR narrative for structuring activity?"
         print(f"\nTest Query: {test_query}")
@@ -61,7 +61,7 @@ class CustomerProfile(BaseModel):
     account_open_date: date
     customer_risk_rating: RiskRating
     last_kyc_refresh: date
-    related_accounts: List[str] = []
+    related_accounts: List[str] = Field(default_factory=list)
     address: str = ""
     phone: str = ""
     email: str = ""
@@ -86,12 +86,12 @@ class PriorSAR(BaseModel):
 
 class RiskIntelligence(BaseModel):
     customer_id: str
-    sanctions_hits: List[str] = []
+    sanctions_hits: List[str] = Field(default_factory=list)
     pep_status: bool = False
-    adverse_media_hits: List[str] = []
-    prior_sars: List[PriorSAR] = []
+    adverse_media_hits: List[str] = Field(default_factory=list)
+    prior_sars: List[PriorSAR] = Field(default_factory=list)
     law_enforcement_requests: int = 0
-    internal_referrals: List[str] = []
+    internal_referrals: List[str] = Field(default_factory=list)
 
 
 class RawAlert(BaseModel):
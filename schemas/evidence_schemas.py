@@ -12,9 +12,9 @@ class BehavioralBaseline(BaseModel):
     avg_monthly_inflow: float
     avg_monthly_outflow: float
     avg_txn_count_per_month: int
-    usual_counterparties: List[str] = []
-    usual_geographies: List[str] = []
-    usual_channels: List[str] = []
+    usual_counterparties: List[str] = Field(default_factory=list)
+    usual_geographies: List[str] = Field(default_factory=list)
+    usual_channels: List[str] = Field(default_factory=list)
     baseline_period: str = ""
     max_single_txn: float = 0.0
 
@@ -23,10 +23,11 @@ class DeviationAnalysis(BaseModel):
     volume_deviation_factor: float = Field(description="Current vs baseline multiplier e.g. 6.8x")
     velocity_spike: bool = False
     new_counterparties_count: int = 0
-    new_geographies: List[str] = []
-    new_channels: List[str] = []
+    new_geographies: List[str] = Field(default_factory=list)
+    new_channels: List[str] = Field(default_factory=list)
     deviation_summary: str = ""
     flagged_txn_count: int = 0
+    flagged_volume: float = Field(default=0.0, description="Total amount of flagged transactions, in and out")
 
 
 class RiskFactor(BaseModel):
@@ -53,7 +54,7 @@ class EnrichedDossier(BaseModel):
     has_sanctions_hits: bool = False
     has_adverse_media: bool = False
     enrichment_timestamp: str = ""
-    sources_consulted: List[str] = []
+    sources_consulted: List[str] = Field(default_factory=list)
     data_quality_score: float = 100.0
     transactions_validated: int = 0
     transactions_quarantined: int = 0
@@ -63,7 +64,7 @@ class EnrichedDossier(BaseModel):
 class TimelineEvent(BaseModel):
     date: str
     event: str
-    txn_ids: List[str] = []
+    txn_ids: List[str] = Field(default_factory=list)
     amount: float = 0.0
     evidence_type: str = "transaction_record"
 
@@ -80,14 +81,14 @@ class FlowOfFundsAnalysis(BaseModel):
     total_inflow: float
     total_outflow: float
     net_position: float
-    flow_chains: List[FlowChain] = []
-    velocity_analysis: Dict = {}
+    flow_chains: List[FlowChain] = Field(default_factory=list)
+    velocity_analysis: Dict = Field(default_factory=dict)
 
 
 class EvidencePointer(BaseModel):
     pointer_id: str = Field(description="e.g. EP-001")
     claim: str = Field(description="The factual claim this evidence supports")
-    source_txn_ids: List[str] = []
+    source_txn_ids: List[str] = Field(default_factory=list)
     source_type: str = Field(description="transaction, kyc, risk_intel, computed")
     computed_value: Optional[str] = None
     verification: str = Field(description="How this claim was verified against source data")
@@ -105,4 +106,4 @@ class EvidencePackage(BaseModel):
     assembly_timestamp: datetime = Field(default_factory=datetime.utcnow)
     total_transactions_analyzed: int = 0
     total_evidence_pointers: int = 0
-    computation_log: List[str] = []
\ No newline at end of file
+    computation_log: List[str] = Field(default_factory=list)
\ No newline at end of file
@@ -11,7 +11,7 @@ from datetime import datetime
 class NarrativeSection(BaseModel):
     section_name: str
     content: str
-    evidence_pointers_used: List[str] = []
+    evidence_pointers_used: List[str] = Field(default_factory=list)
     confidence: float = Field(ge=0, le=1.0, default=1.0)
 
 
@@ -20,8 +20,8 @@ class DraftNarrative(BaseModel):
     case_id: str
     title: str
     filing_type: str = Field(description="initial, continuing, corrected")
-    subject_info: Dict = {}
-    sections: List[NarrativeSection] = []
+    subject_info: Dict = Field(default_factory=dict)
+    sections: List[NarrativeSection] = Field(default_factory=list)
     full_narrative: str = ""
     word_count: int = 0
     generation_model: str = ""
@@ -61,19 +61,19 @@ class AuditPackage(BaseModel):
     case_id: str
     pipeline_version: str = "SARATHI v0.1"
     generated_at: datetime = Field(default_factory=datetime.utcnow)
-    sentence_traces: List[SentenceLevelTrace] = []
-    ingestion_audit: Dict = {}
-    enrichment_audit: Dict = {}
-    triage_audit: Dict = {}
-    typology_audit: Dict = {}
-    evidence_assembly_audit: Dict = {}
-    narrative_generation_audit: Dict = {}
-    validation_audit: Dict = {}
+    sentence_traces: List[SentenceLevelTrace] = Field(default_factory=list)
+    ingestion_audit: Dict = Field(default_factory=dict)
+    enrichment_audit: Dict = Field(default_factory=dict)
+    triage_audit: Dict = Field(default_factory=dict)
+    typology_audit: Dict = Field(default_factory=dict)
+    evidence_assembly_audit: Dict = Field(default_factory=dict)
+    narrative_generation_audit: Dict = Field(default_factory=dict)
+    validation_audit: Dict = Field(default_factory=dict)
     llm_model: str = ""
     embedding_model: str = ""
-    prompt_versions: Dict[str, str] = {}
-    all_prompt_hashes: Dict[str, str] = {}
-    human_edits_log: List[Dict] = []
+    prompt_versions: Dict[str, str] = Field(default_factory=dict)
+    all_prompt_hashes: Dict[str, str] = Field(default_factory=dict)
+    human_edits_log: List[Dict] = Field(default_factory=list)
 
 
 class SAROutput(BaseModel):
@@ -33,7 +33,7 @@ class TriageDecision(BaseModel):
     behavioral_anomaly_score: float = 0.0
     llm_reasoning: Optional[str] = None
     explanation: str
-    decision_factors: List[DecisionFactor] = []
+    decision_factors: List[DecisionFactor] = Field(default_factory=list)
     triage_timestamp: datetime = Field(default_factory=datetime.utcnow)
     rules_evaluated: int = 0
     llm_used: bool = False
@@ -43,15 +43,15 @@ class TriageDecision(BaseModel):
 class TypologyMatch(BaseModel):
     code: str
     name: str
-    fincen_activity_codes: List[str] = []
+    fincen_activity_codes: List[str] = Field(default_factory=list)
     confidence: float = Field(ge=0, le=1.0)
     reasoning: str
-    matched_indicators: List[str] = []
+    matched_indicators: List[str] = Field(default_factory=list)
 
 
 class TypologyAssessment(BaseModel):
     """Output of typology classification."""
     primary_typology: Optional[TypologyMatch] = None
-    secondary_typologies: List[TypologyMatch] = []
+    secondary_typologies: List[TypologyMatch] = Field(default_factory=list)
     total_typologies_evaluated: int = 0
     assessment_timestamp: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file